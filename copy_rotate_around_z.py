@@ -12,6 +12,17 @@ from mathutils import Vector, Matrix
 # 間隔の倍率（オブジェクトサイズに対する比率。1.1 = 今の1.1倍の間隔）
 SPACING_RATIO = 1.1
 
+# コピーの配置: (名前の接尾辞, Z 回転のクォータニオン, 配置方向の単位ベクトル)
+# 回転は定数なので、オブジェクトごとに作り直さずここで 1 回だけ作る
+_PLACEMENTS = tuple(
+    (suffix, Matrix.Rotation(math.radians(angle), 4, 'Z').to_quaternion(), Vector(direction))
+    for suffix, angle, direction in (
+        ("_L", -90, (-1, 0, 0)),  # 左: Z -90°、位置は -X
+        ("_R", 90, (1, 0, 0)),    # 右: Z +90°、位置は +X
+        ("_D", 180, (0, 0, -1)),  # 下: Z 180°、位置は -Z
+    )
+)
+
 
 def get_object_size(obj):
     """オブジェクトのバウンディングボックスからサイズ（各軸の長さ）を取得。"""
@@ -40,31 +51,18 @@ def duplicate_and_place_rotated(obj, spacing):
 
     base_loc = obj.matrix_world.translation.copy()
     base_rot = obj.matrix_world.to_quaternion()
-
-    # 左: Z -90°、位置は -X
-    rot_left = base_rot @ Matrix.Rotation(math.radians(-90), 4, 'Z').to_quaternion()
-    loc_left = base_loc + Vector((-spacing, 0, 0))
-
-    # 右: Z +90°、位置は +X
-    rot_right = base_rot @ Matrix.Rotation(math.radians(90), 4, 'Z').to_quaternion()
-    loc_right = base_loc + Vector((spacing, 0, 0))
-
-    # 下: Z 180°、位置は -Z
-    rot_down = base_rot @ Matrix.Rotation(math.radians(180), 4, 'Z').to_quaternion()
-    loc_down = base_loc + Vector((0, 0, -spacing))
+    base_scale = obj.matrix_world.to_scale()
 
     copies = []
 
-    for name_suffix, loc, rot in [
-        ("_L", loc_left, rot_left),
-        ("_R", loc_right, rot_right),
-        ("_D", loc_down, rot_down),
-    ]:
+    for name_suffix, rot_z, direction in _PLACEMENTS:
+        loc = base_loc + direction * spacing
+        rot = base_rot @ rot_z
         dup = obj.copy()
         dup.data = obj.data
         dup.animation_data_clear()
         dup.name = obj.name + name_suffix
-        dup.matrix_world = Matrix.LocRotScale(loc, rot, obj.matrix_world.to_scale())
+        dup.matrix_world = Matrix.LocRotScale(loc, rot, base_scale)
         collection.objects.link(dup)
         copies.append(dup)
 
@@ -2,7 +2,11 @@
 # 選択オブジェクトの頂点色・マテリアルを診断（Blender で実行）
 
 import bpy
-import bmesh
+import numpy as np
+
+# 頂点色の平均を求めるときに使う先頭ループ数
+SAMPLE_LOOPS = 300
+
 
 def diagnose():
     ob = bpy.context.active_object
@@ -21,55 +25,26 @@ def diagnose():
     else:
         print("メッシュに color_attributes がありません（旧形式の可能性）")
 
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-    bm.verts.ensure_lookup_table()
-
-    # bmesh の頂点色レイヤー（byte）
-    if hasattr(bm.loops.layers, "color") and bm.loops.layers.color:
-        for name, layer in bm.loops.layers.color.items():
+    # 面コーナーの頂点色（Blender 4.0+ の byte / float カラー属性）
+    # foreach_get で全ループを一括取得し、先頭 SAMPLE_LOOPS ループの平均を表示する
+    corner_attrs = []
+    if hasattr(mesh, "color_attributes"):
+        corner_attrs = [a for a in mesh.color_attributes if a.domain == "CORNER"]
+    n_loops = len(mesh.loops)
+    for data_type, label in (("BYTE_COLOR", "byte"), ("FLOAT_COLOR", "float")):
+        for attr in corner_attrs:
+            if attr.data_type != data_type:
+                continue
+            n = min(SAMPLE_LOOPS, n_loops)
             sample_r, sample_g, sample_b = 0.0, 0.0, 0.0
-            n = 0
-            for face in bm.faces:
-                for loop in face.loops:
-                    c = loop[layer]
-                    sample_r += c[0]
-                    sample_g += c[1]
-                    sample_b += c[2]
-                    n += 1
-                    if n >= 300:
-                        break
-                if n >= 300:
-                    break
-            if n:
-                sample_r /= n
-                sample_g /= n
-                sample_b /= n
-            print(f"  bmesh 頂点色レイヤー(byte): \"{name}\" (サンプル平均 RGB: {sample_r:.3f}, {sample_g:.3f}, {sample_b:.3f})")
-    # float color (Blender 4.0+ の属性によってはこちら)
-    if hasattr(bm.loops.layers, "float_color") and bm.loops.layers.float_color:
-        for name, layer in bm.loops.layers.float_color.items():
-            sample_r, sample_g, sample_b = 0.0, 0.0, 0.0
-            n = 0
-            for face in bm.faces:
-                for loop in face.loops:
-                    c = loop[layer]
-                    sample_r += c[0]
-                    sample_g += c[1]
-                    sample_b += c[2]
-                    n += 1
-                    if n >= 300:
-                        break
-                if n >= 300:
-                    break
             if n:
-                sample_r /= n
-                sample_g /= n
-                sample_b /= n
-            print(f"  bmesh 頂点色レイヤー(float): \"{name}\" (サンプル平均 RGB: {sample_r:.3f}, {sample_g:.3f}, {sample_b:.3f})")
-    if not (getattr(bm.loops.layers, "color", None) and bm.loops.layers.color) and \
-       not (getattr(bm.loops.layers, "float_color", None) and bm.loops.layers.float_color):
-        print("  bmesh に頂点色レイヤーがありません → マテリアルで色分けされます。")
+                buf = np.empty(n_loops * 4, dtype=np.float32)
+                # byte は格納値（sRGB）のまま読む（エクスポートスクリプトと同じ値）
+                attr.data.foreach_get("color_srgb" if data_type == "BYTE_COLOR" else "color", buf)
+                sample_r, sample_g, sample_b = buf[:n * 4].reshape(-1, 4)[:, :3].mean(axis=0).tolist()
+            print(f"  頂点色レイヤー({label}): \"{attr.name}\" (サンプル平均 RGB: {sample_r:.3f}, {sample_g:.3f}, {sample_b:.3f})")
+    if not corner_attrs:
+        print("  面コーナーの頂点色レイヤーがありません → マテリアルで色分けされます。")
 
     # マテリアル
     if ob.material_slots:
@@ -88,7 +63,6 @@ def diagnose():
     else:
         print("マテリアルスロットがありません。")
 
-    bm.free()
     print("--- 診断終了 ---")
 
 if __name__ == "__main__":
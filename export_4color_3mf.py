@@ -1,19 +1,52 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # Blender 5.0.1 向け: 4色減色 → 頂点色付き OBJ エクスポート（Bambu Studio 2.5.0.66 等）
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+
 import bpy
 import bmesh
+import numpy as np
 from bpy_extras.io_utils import ExportHelper
 
+try:
+    # 任意: numba があれば k-means の割り当て・集計を JIT + 並列化（Blender 標準には含まれない）
+    import numba
+    from numba import prange
+except ImportError:
+    numba = None
+    prange = range
+
+try:
+    # 任意: scikit-learn があれば面数の多いメッシュは MiniBatchKMeans で減色（Blender 標準には含まれない）
+    from sklearn.cluster import MiniBatchKMeans as _MiniBatchKMeans
+except ImportError:
+    _MiniBatchKMeans = None
+
 # ---------- 設定 ----------
 OUTPUT_PATH = "D:/3DCG/output_4colors_quantized_only.obj"
 NUM_COLORS = 0  # 0 = 減色なし（元の色をそのまま出力）, 2以上 = 指定色数に減色
-KMEANS_ITERATIONS = 20
+KMEANS_ITERATIONS = 20  # K-means の最大反復回数（収束すればそれより前に終了）
+KMEANS_SSE_TOL = 1e-6  # 収束判定: 二乗誤差の相対変化がこれ以下なら打ち切り
+KMEANS_TOL = 1e-4  # 収束判定: 重心の移動量（K-means の色空間での各成分の最大値）がこれ未満なら打ち切り
+KMEANS_COLOR_SPACE = "LAB"  # K-means の色空間: "LAB" = CIE Lab（知覚的に均等）, "RGB" = 0..1 の RGB のまま
+USE_NUMBA = True  # True: numba がインストールされていれば k-means を numba で高速化（なければ NumPy）
+USE_MINIBATCH_KMEANS = True  # True: scikit-learn があれば、面数が MINIBATCH_MIN_FACES を超えるメッシュは MiniBatchKMeans で減色
+MINIBATCH_MIN_FACES = 50000  # MiniBatchKMeans に切り替える面数
+MINIBATCH_BATCH_SIZE = 4096  # MiniBatchKMeans のバッチサイズ
+MINIBATCH_STEPS = 100  # MiniBatchKMeans で重心を更新するミニバッチの数
+MINIBATCH_PREDICT_CHUNK = 1000000  # 全面の割り当てをこの面数ずつ行う（メモリ節約）
+PARALLEL_OBJECTS = True  # True: 複数オブジェクト選択時、各オブジェクトの k-means をスレッドで並行に実行
+PALETTE_MIN_DISTANCE = 0.1  # 減色後のパレットで、この RGB 距離より近い色の組があり全体が白/黒っぽければ区別しやすい色に置き換える
+SPLIT_DELETE_MIN_RATIO = 0.5  # split モード: 面数の割合がこれ以上の色は元メッシュの複製から他の面を削除して作る（1 より大で常に組み直し）
 EXPORT_SCALE = 0.1  # 出力サイズを10%に
 USE_SELECTION_ONLY = True  # True: 選択されたメッシュのみ処理（1体だけ出力したい場合は1つだけ選択）
 BAKE_TO_VERTEX_COLOR = True  # True: 表示色を頂点カラーにベイクしてから減色（テクスチャ等も反映）
 PRIORITIZE_BAKE_OVER_VERTEX_COLOR = True  # True: 頂点カラーがあっても焼き込みを優先（デフォルトオン）
 BAKE_TARGET_ATTR_NAME = "Col"  # ベイク先のカラー属性名（"Col" で既存を上書き / "Color" で新規）
+BAKE_SKIP_VARIANCE = 0.005  # 焼き込み優先がオフのとき、既存の頂点カラーの分散がこれを超えていればベイクを省く
+BAKE_SAMPLES = 16  # ベイク時の Cycles サンプル数（色パスのみなので少なくてよい。0 でシーンの設定のまま）
 
 # エクスポートモード: "split" = 色ごとにメッシュ分割（従来）, "vertex_color_only" = 分割せず頂点色のみ（非多様体回避）
 EXPORT_MODE = "vertex_color_only"  # 非多様体エッジを避けたい場合はこのまま。従来どおり分割したい場合は "split"
@@ -49,7 +82,6 @@ def bake_material_to_vertex_colors(obj, target_attr_name="Col"):
     Cycles のベイクで target=VERTEX_COLORS を使用。ベイク先はアクティブなカラー属性。
     """
     scene = bpy.context.scene
-    view_layer = bpy.context.view_layer
     mesh = obj.data
     if not mesh.polygons:
         return False
@@ -82,121 +114,142 @@ def bake_material_to_vertex_colors(obj, target_attr_name="Col"):
             bake.use_pass_color = True
         if hasattr(bake, "use_pass_diffuse"):
             bake.use_pass_diffuse = True
-    # 選択をこのオブジェクトだけに
-    bpy.ops.object.select_all(action="DESELECT")
-    obj.select_set(True)
-    view_layer.objects.active = obj
+    # 照明なしの色パスだけなのでサンプル数は少なくてよい（終わったらシーンの設定に戻す）
+    prev_samples = None
+    if BAKE_SAMPLES > 0 and hasattr(scene, "cycles"):
+        prev_samples = scene.cycles.samples
+        scene.cycles.samples = BAKE_SAMPLES
     try:
-        bpy.ops.object.bake(type="DIFFUSE")
+        # シーンの選択状態は変えず、このオブジェクトだけを対象にしたコンテキストでベイク
+        with bpy.context.temp_override(active_object=obj, object=obj, selected_objects=[obj],
+                                       selected_editable_objects=[obj]):
+            bpy.ops.object.bake(type="DIFFUSE")
         return True
     except Exception as e:
         print(f"  ベイク失敗: {e}")
         return False
+    finally:
+        if prev_samples is not None:
+            scene.cycles.samples = prev_samples
 
 
-def get_face_colors_from_mesh(obj):
-    """メッシュから面ごとの色を取得。頂点色またはマテリアルから取得。"""
-    mesh = obj.data
-    if not mesh.polygons:
-        return None, []
+def _pick_corner_color_attribute(mesh):
+    """
+    面コーナー（ループ）ドメインのカラー属性を選ぶ。
+    byte を優先し、なければ float。各種類の中では "Color" → "Col"（Tripo/OBJ等）→ active → 最初の属性。
+    戻り値: (属性 or None, float 属性か, ログ用の名前)
+    """
+    active = mesh.color_attributes.active_color
+    for data_type in ("BYTE_COLOR", "FLOAT_COLOR"):
+        attrs = [a for a in mesh.color_attributes if a.domain == "CORNER" and a.data_type == data_type]
+        if not attrs:
+            continue
+        use_float = data_type == "FLOAT_COLOR"
+        for preferred in ("Color", "Col"):
+            for a in attrs:
+                if a.name == preferred:
+                    return a, use_float, preferred
+        if active is not None:
+            for a in attrs:
+                if a.name == active.name:
+                    return a, use_float, "active"
+        return attrs[0], use_float, attrs[0].name
+    return None, False, None
 
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-    bm.verts.ensure_lookup_table()
 
-    # 頂点色レイヤーを探す（"Color" → "Col"（Tripo/OBJ等）→ active → 最初のレイヤー）
-    color_layer = None
-    layer_name_used = None
-    use_float_layer = False
+# ループ単位の RGBA 作業バッファ（オブジェクトをまたいで使い回し、足りないときだけ大きくする）
+_SCRATCH = {}
 
-    def pick_byte_color_layer():
-        nonlocal color_layer, layer_name_used
-        if not getattr(bm.loops.layers, "color", None) or not bm.loops.layers.color:
-            return
-        layers = bm.loops.layers.color
-        for preferred in ("Color", "Col"):
-            color_layer = layers.get(preferred)
-            if color_layer is not None:
-                layer_name_used = preferred
-                return
-        if getattr(layers, "active", None) is not None:
-            color_layer = layers.active
-            layer_name_used = "active"
-            return
-        for name, layer in layers.items():
-            color_layer = layer
-            layer_name_used = name
-            return
 
-    def pick_float_color_layer():
-        nonlocal color_layer, layer_name_used, use_float_layer
-        if not getattr(bm.loops.layers, "float_color", None) or not bm.loops.layers.float_color:
-            return
-        layers = bm.loops.layers.float_color
-        for preferred in ("Color", "Col"):
-            layer = layers.get(preferred)
-            if layer is not None:
-                layer_name_used = preferred
-                break
-        else:
-            layer = None
-        if layer is None and getattr(layers, "active", None) is not None:
-            layer = layers.active
-            layer_name_used = "active"
-        elif layer is None:
-            for name, l in layers.items():
-                layer = l
-                layer_name_used = name
-                break
-        if layer is not None:
-            color_layer = layer
-            use_float_layer = True
+def _scratch(name, size, dtype=np.float32):
+    """
+    名前ごとの作業バッファから size 要素分のビューを返す。
+    次に同じ名前で呼ぶと中身は上書きされるので、呼び出し側ですぐに使い切ること（メインスレッド専用）。
+    """
+    buf = _SCRATCH.get(name)
+    if buf is None or buf.size < size or buf.dtype != dtype:
+        buf = np.empty(max(size, 1 << 20), dtype=dtype)
+        _SCRATCH[name] = buf
+    return buf[:size]
+
+
+def _read_corner_colors(mesh, attr):
+    """
+    カラー属性の全ループの RGB を foreach_get で一括取得し (ループ数, 3) の配列で返す。
+    戻り値は作業バッファのビューなので、次の呼び出しまでに使い切ること。
+    """
+    buf = _scratch("loop_rgba", len(mesh.loops) * 4)
+    # byte は bmesh と同じく格納値（sRGB）のまま 0..1 で読む。float は格納値そのまま
+    attr.data.foreach_get("color_srgb" if attr.data_type == "BYTE_COLOR" else "color", buf)
+    return buf.reshape(-1, 4)[:, :3]
+
+
+@lru_cache(maxsize=None)
+def _base_color_of(mat_name):
+    """
+    マテリアル名 → Principled BSDF の Base Color (r, g, b)。ノードがなければ None。
+    ノードツリーの走査が1マテリアル1回で済むようにキャッシュする（process_scene の開始時にクリア）。
+    """
+    mat = bpy.data.materials.get(mat_name)
+    if mat and getattr(mat, "node_tree", None) is not None:
+        for n in mat.node_tree.nodes:
+            if n.type == "BSDF_PRINCIPLED":
+                return tuple(n.inputs["Base Color"].default_value[:3])
+    return None
+
+
+def _principled_base_color(mat):
+    """マテリアルの Principled BSDF の Base Color (r, g, b)。ノードがなければグレー。"""
+    color = _base_color_of(mat.name) if mat else None
+    return color if color is not None else (0.5, 0.5, 0.5)
+
 
-    pick_byte_color_layer()
-    if color_layer is None:
-        pick_float_color_layer()
+def get_face_colors_from_mesh(obj, pipeline=None):
+    """
+    メッシュから面ごとの色を取得。頂点色またはマテリアルから取得。
+    pipeline（MeshColorPipeline）を渡すと、そこで読み込み済みのループ範囲を使い回す。
+    戻り値の face_colors は float32 の (面数, 3) 配列。
+    """
+    mesh = obj.data
+    if not mesh.polygons:
+        return None, np.empty((0, 3), dtype=np.float32)
+
+    color_attr, use_float_layer, layer_name_used = _pick_corner_color_attribute(mesh)
     if layer_name_used:
         print(f"  頂点色レイヤーを使用: \"{layer_name_used}\" ({'float' if use_float_layer else 'byte'}) (オブジェクト: {obj.name})")
 
-    face_colors = []
-    has_vertex_color = color_layer is not None
-    n_faces = len(bm.faces)
-    log_interval = PROGRESS_LOG_INTERVAL if PROGRESS_LOG_INTERVAL > 0 else n_faces + 1
+    has_vertex_color = color_attr is not None
+    n_faces = len(mesh.polygons)
 
     if has_vertex_color:
-        for fi, face in enumerate(bm.faces):
-            if (fi + 1) % log_interval == 0 or fi == 0 or fi == n_faces - 1:
-                print(f"    面の色取得: {fi + 1}/{n_faces}")
-            r, g, b = 0.0, 0.0, 0.0
-            n = len(face.loops)
-            for loop in face.loops:
-                c = loop[color_layer]
-                # byte は 0-1 で渡ってくる想定。float も 0-1
-                r += float(c[0])
-                g += float(c[1])
-                b += float(c[2])
-            face_colors.append((r / n, g / n, b / n))
+        # ループ色・ポリゴンのループ範囲を一括で読み、面ごとの平均を reduceat で求める
+        print(f"    面の色取得: {n_faces} 面（一括読み込み）")
+        pipe = pipeline or MeshColorPipeline(obj)
+        loop_colors = _read_corner_colors(mesh, color_attr)
+        loop_total = pipe.loop_total
+        face_size = int(loop_total[0])
+        if len(loop_colors) == n_faces * face_size and (loop_total == face_size).all():
+            # 全面が同じ頂点数（三角形のみ・四角形のみ等）: 面のループは詰めて並ぶので、
+            # 各面の j 番目のコーナーを刻み幅 face_size で取り出して足すだけでよい（reduceat より速い）
+            sums = loop_colors[0::face_size].copy()
+            for j in range(1, face_size):
+                sums += loop_colors[j::face_size]
+            face_colors = sums * np.float32(1.0 / face_size)
+        else:
+            sums = np.add.reduceat(loop_colors, pipe.loop_start, axis=0)
+            face_colors = (sums / loop_total[:, None]).astype(np.float32, copy=False)
     else:
         # マテリアルベース: 面のマテリアルインデックスからベースカラー取得
-        for fi, face in enumerate(bm.faces):
-            if (fi + 1) % log_interval == 0 or fi == 0 or fi == n_faces - 1:
-                print(f"    面の色取得: {fi + 1}/{n_faces}")
-            mat_index = face.material_index
-            if mat_index is not None and mat_index < len(obj.material_slots):
-                mat = obj.material_slots[mat_index].material
-                if mat and getattr(mat, "node_tree", None) is not None:
-                    base_color = (0.5, 0.5, 0.5)
-                    for n in mat.node_tree.nodes:
-                        if n.type == "BSDF_PRINCIPLED":
-                            base_color = n.inputs["Base Color"].default_value[:3]
-                            break
-                    face_colors.append(tuple(base_color))
-                else:
-                    face_colors.append((0.5, 0.5, 0.5))
-            else:
-                face_colors.append((0.5, 0.5, 0.5))
+        # スロットごとの色を先に1回だけ求め、全面のマテリアルインデックスで一括で引く
+        print(f"    面の色取得: {n_faces} 面（マテリアル色）")
+        slot_colors = [_principled_base_color(slot.material) for slot in obj.material_slots]
+        slot_colors.append((0.5, 0.5, 0.5))  # 範囲外のマテリアルインデックス用
+        mat_index = np.empty(n_faces, dtype=np.int32)
+        mesh.polygons.foreach_get("material_index", mat_index)
+        fallback = len(slot_colors) - 1
+        mat_index[(mat_index < 0) | (mat_index >= fallback)] = fallback
+        face_colors = np.asarray(slot_colors, dtype=np.float32)[mat_index]
 
-    bm.free()
     return has_vertex_color, face_colors
 
 
@@ -204,6 +257,7 @@ def get_face_colors_from_texture(obj, texture_sample_rotation=None, texture_samp
     """
     マテリアルから Image Texture を取得し、各面の UV でテクスチャをサンプリングして面の色を返す。
     マテリアルの UV Map ノードで指定された UV レイヤーを使用（ずれ防止）。
+    戻り値は float32 の (面数, 3) 配列（テクスチャがなければ None）。
     """
     mesh = obj.data
     if not mesh.polygons:
@@ -293,70 +347,256 @@ def get_face_colors_from_texture(obj, texture_sample_rotation=None, texture_samp
             face_colors.append((r / n, g / n, b / n))
         else:
             face_colors.append((0.5, 0.5, 0.5))
-    return face_colors
+    return np.asarray(face_colors, dtype=np.float32).reshape(-1, 3)
+
+
+def _vertex_color_variance(obj, max_samples=1024):
+    """既存の面コーナー頂点カラーから等間隔に最大 max_samples ループ分を取り、RGB 各成分の分散の最大値を返す（なければ 0）。"""
+    mesh = obj.data
+    attr, _, _ = _pick_corner_color_attribute(mesh)
+    if attr is None or not mesh.loops:
+        return 0.0
+    colors = _read_corner_colors(mesh, attr)
+    step = max(1, len(colors) // max_samples)
+    return float(colors[::step].var(axis=0).max())
 
 
 def _has_color_variance(face_colors, threshold=0.02):
     """面の色に十分なばらつきがあるか判定。"""
-    if not face_colors or len(face_colors) < 2:
+    if face_colors is None or len(face_colors) < 2:
         return False
-    min_r = min(c[0] for c in face_colors)
-    max_r = max(c[0] for c in face_colors)
-    min_g = min(c[1] for c in face_colors)
-    max_g = max(c[1] for c in face_colors)
-    min_b = min(c[2] for c in face_colors)
-    max_b = max(c[2] for c in face_colors)
-    return (max_r - min_r) > threshold or (max_g - min_g) > threshold or (max_b - min_b) > threshold
+    X = np.asarray(face_colors, dtype=np.float32)[:, :3]
+    return bool(((X.max(axis=0) - X.min(axis=0)) > threshold).any())
 
 
-def quantize_colors_kmeans(face_colors, k=4, max_iter=20):
-    """面の色リストを k 色に減色（簡易 k-means）。"""
-    if not face_colors or len(face_colors) < k:
-        # 色が少ない場合はそのまま or 補完
-        while len(face_colors) < k:
-            face_colors = face_colors + [(0.2, 0.2, 0.2), (0.5, 0.5, 0.5), (0.8, 0.8, 0.8)][:k - len(face_colors)]
-        return list(face_colors)[:k], [0] * len(face_colors)
+def _index_dtype(k):
+    """パレット番号の dtype。k ≤ 256 なら 1 バイトに収める。"""
+    return np.uint8 if k <= 256 else np.int32
 
-    # 初期重心: なるべく離すためにサンプルから選ぶ
-    step = max(1, len(face_colors) // k)
-    centroids = [tuple(face_colors[i]) for i in range(0, len(face_colors), step)][:k]
-    while len(centroids) < k:
-        centroids.append((0.0, 0.0, 0.0))
 
-    def dist(a, b):
-        return sum((x - y) ** 2 for x, y in zip(a, b)) ** 0.5
+def _uses_single_color(assignments):
+    """全面が同じパレット番号に割り当てられているか（空も含む）。"""
+    a = np.asarray(assignments)
+    return a.size == 0 or bool((a == a[0]).all())
 
-    n_fc = len(face_colors)
-    if PROGRESS_LOG_INTERVAL > 0 and n_fc >= PROGRESS_LOG_INTERVAL:
-        print(f"  K-means 減色中: {n_fc} 面, {max_iter} 反復")
 
-    assignments = [0] * len(face_colors)
-    for it in range(max_iter):
-        if PROGRESS_LOG_INTERVAL > 0 and n_fc >= PROGRESS_LOG_INTERVAL and (it + 1) % max(1, max_iter // 4) == 0:
-            print(f"    反復 {it + 1}/{max_iter}")
-        # assign
-        for i, c in enumerate(face_colors):
+# sRGB (D65) ⇔ CIE XYZ の変換行列と D65 白色点
+_SRGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+], dtype=np.float32)
+_XYZ_TO_SRGB = np.linalg.inv(_SRGB_TO_XYZ).astype(np.float32)
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+_LAB_DELTA = 6.0 / 29.0
+
+
+def _srgb_to_lab(rgb):
+    """sRGB (N, 3) 0..1 → CIE Lab (N, 3)。面の色は頂点カラー（sRGB）として書き戻すので sRGB とみなす。"""
+    c = np.clip(rgb, 0.0, 1.0)
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = (linear @ _SRGB_TO_XYZ.T) / _D65_WHITE
+    f = np.where(xyz > _LAB_DELTA ** 3, np.cbrt(xyz), xyz / (3.0 * _LAB_DELTA ** 2) + 4.0 / 29.0)
+    lab = np.stack([116.0 * f[:, 1] - 16.0, 500.0 * (f[:, 0] - f[:, 1]), 200.0 * (f[:, 1] - f[:, 2])], axis=1)
+    return lab.astype(np.float32)
+
+
+def _lab_to_srgb(lab):
+    """CIE Lab (N, 3) → sRGB (N, 3) 0..1（色域外はクリップ）。"""
+    fy = (lab[:, 0] + 16.0) / 116.0
+    f = np.stack([fy + lab[:, 1] / 500.0, fy, fy - lab[:, 2] / 200.0], axis=1)
+    xyz = np.where(f > _LAB_DELTA, f ** 3, 3.0 * _LAB_DELTA ** 2 * (f - 4.0 / 29.0)) * _D65_WHITE
+    linear = np.clip(xyz @ _XYZ_TO_SRGB.T, 0.0, 1.0)
+    srgb = np.where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1.0 / 2.4) - 0.055)
+    return srgb.astype(np.float32)
+
+
+def _kmeans_plus_plus_init(X, k, seed=0):
+    """
+    k-means++ で初期重心を選ぶ。
+    1つ目はランダム、以降は「既に選んだ重心までの最短二乗距離」に比例した確率で選ぶ。
+    乱数は seed 固定なので、同じ入力なら毎回同じパレットになる。
+    """
+    rng = np.random.default_rng(seed)
+    n = len(X)
+    centroids = np.empty((k, X.shape[1]), dtype=np.float32)
+    centroids[0] = X[rng.integers(n)]
+    closest_d2 = ((X - centroids[0]) ** 2).sum(1)
+    for j in range(1, k):
+        total = float(closest_d2.sum())
+        if total > 0.0:
+            idx = rng.choice(n, p=closest_d2 / total)
+        else:
+            # 全面が同じ色: 距離で選べないので一様に選ぶ
+            idx = rng.integers(n)
+        centroids[j] = X[idx]
+        closest_d2 = np.minimum(closest_d2, ((X - centroids[j]) ** 2).sum(1))
+    return centroids
+
+
+def _assign_and_accumulate(X, centroids, Xn=None):
+    """
+    k-means の1反復分: 各面を最も近い重心に割り当て、色ごとの合計・面数・二乗誤差を集計する。
+    Xn は各面の ||X||²（反復中は変わらないので呼び出し側で1回だけ計算して渡せる）。
+    戻り値: (assignments, sums (k, 3), counts (k,), sse)
+    """
+    k = len(centroids)
+    if Xn is None:
+        Xn = (X * X).sum(1)
+    # 全面 × 全重心の二乗距離 ||X||² + ||C||² - 2 X·Cᵀ（(N, k, 3) の中間配列を作らず、交差項は行列積1回）
+    # ||X||² は行ごとの定数で argmin を変えないので、(N, k) には足さず選ばれた距離にだけ足す。sqrt も不要
+    d2_shifted = (centroids * centroids).sum(1)[None, :] - 2.0 * (X @ centroids.T)
+    assignments = d2_shifted.argmin(1)
+    nearest_d2 = np.take_along_axis(d2_shifted, assignments[:, None], axis=1)[:, 0] + Xn
+    # 桁落ちでわずかに負になることがあるので 0 で切る
+    sse = float(np.maximum(nearest_d2, 0.0).sum(dtype=np.float64))
+    counts = np.bincount(assignments, minlength=k)
+    sums = np.stack([np.bincount(assignments, weights=X[:, t], minlength=k) for t in range(3)], axis=1)
+    return assignments, sums, counts, sse
+
+
+def _assign_and_accumulate_kernel(X, centroids):
+    """
+    _assign_and_accumulate の numba 版（njit して使う）。
+    距離行列 (N, k) を作らず、割り当てと集計を面ごとの1パスで行う。
+    面を固定数のチャンクに分けて並列処理し、チャンクごとの部分和を最後に足し合わせる。
+    """
+    n = X.shape[0]
+    k = centroids.shape[0]
+    n_chunks = min(n, 256)
+    labels = np.empty(n, dtype=np.int64)
+    part_sums = np.zeros((n_chunks, k, 3))
+    part_counts = np.zeros((n_chunks, k), dtype=np.int64)
+    part_sse = np.zeros(n_chunks)
+    for c in prange(n_chunks):
+        lo = c * n // n_chunks
+        hi = (c + 1) * n // n_chunks
+        for i in range(lo, hi):
+            r = X[i, 0]
+            g = X[i, 1]
+            b = X[i, 2]
             best = 0
-            best_d = dist(c, centroids[0])
+            best_d2 = (r - centroids[0, 0]) ** 2 + (g - centroids[0, 1]) ** 2 + (b - centroids[0, 2]) ** 2
             for j in range(1, k):
-                d = dist(c, centroids[j])
-                if d < best_d:
-                    best_d = d
+                d2 = (r - centroids[j, 0]) ** 2 + (g - centroids[j, 1]) ** 2 + (b - centroids[j, 2]) ** 2
+                if d2 < best_d2:
+                    best_d2 = d2
                     best = j
-            assignments[i] = best
-        # update centroids
-        new_centroids = [[0.0, 0.0, 0.0] for _ in range(k)]
-        counts = [0] * k
-        for i, c in enumerate(face_colors):
-            j = assignments[i]
-            for t in range(3):
-                new_centroids[j][t] += c[t]
-            counts[j] += 1
-        for j in range(k):
-            if counts[j] > 0:
-                centroids[j] = tuple(new_centroids[j][t] / counts[j] for t in range(3))
-
-    return [tuple(c) for c in centroids], assignments
+            labels[i] = best
+            part_sums[c, best, 0] += r
+            part_sums[c, best, 1] += g
+            part_sums[c, best, 2] += b
+            part_counts[c, best] += 1
+            part_sse[c] += best_d2
+    return labels, part_sums.sum(axis=0), part_counts.sum(axis=0), part_sse.sum()
+
+
+_assign_and_accumulate_numba = None
+if numba is not None and USE_NUMBA:
+    try:
+        _assign_and_accumulate_numba = numba.njit(parallel=True, fastmath=True, cache=True)(_assign_and_accumulate_kernel)
+    except RuntimeError:
+        # テキストエディタから実行した場合などキャッシュ先がないときはキャッシュなしで JIT
+        _assign_and_accumulate_numba = numba.njit(parallel=True, fastmath=True)(_assign_and_accumulate_kernel)
+
+
+def _lloyd_kmeans(X, k, max_iter):
+    """k-means++ で初期化し、収束するか max_iter に達するまで Lloyd 反復する。戻り値: (centroids, assignments)"""
+    n = len(X)
+    centroids = _kmeans_plus_plus_init(X, k)
+
+    if PROGRESS_LOG_INTERVAL > 0 and n >= PROGRESS_LOG_INTERVAL:
+        print(f"  K-means 減色中: {n} 面, {max_iter} 反復")
+
+    if _assign_and_accumulate_numba is not None:
+        assign_and_accumulate = _assign_and_accumulate_numba
+    else:
+        # ||X||² は反復中に変わらないので1回だけ計算しておく
+        assign_and_accumulate = partial(_assign_and_accumulate, Xn=(X * X).sum(1))
+    assignments = None
+    prev_sse = None
+    for it in range(max_iter):
+        if PROGRESS_LOG_INTERVAL > 0 and n >= PROGRESS_LOG_INTERVAL and (it + 1) % max(1, max_iter // 4) == 0:
+            print(f"    反復 {it + 1}/{max_iter}")
+        prev_assignments = assignments
+        assignments, sums, counts, sse = assign_and_accumulate(X, centroids)
+        # 収束判定: 割り当てが変わらない、または SSE がほぼ変わらなければ打ち切り
+        converged = prev_assignments is not None and np.array_equal(prev_assignments, assignments)
+        if not converged and prev_sse is not None:
+            converged = abs(prev_sse - sse) <= KMEANS_SSE_TOL * prev_sse
+        if converged:
+            if PROGRESS_LOG_INTERVAL > 0 and n >= PROGRESS_LOG_INTERVAL:
+                print(f"    収束: {it + 1} 反復で終了")
+            break
+        prev_sse = sse
+        # update centroids: 空になった色は前の重心のまま
+        prev_centroids = centroids.copy()
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # 重心がほとんど動かなくなったら打ち切り
+        if float(np.abs(centroids - prev_centroids).max()) < KMEANS_TOL:
+            if PROGRESS_LOG_INTERVAL > 0 and n >= PROGRESS_LOG_INTERVAL:
+                print(f"    収束（重心の移動が {KMEANS_TOL} 未満）: {it + 1} 反復で終了")
+            break
+    return centroids, assignments
+
+
+def _minibatch_kmeans(X, k):
+    """
+    面数が多いとき用: scikit-learn の MiniBatchKMeans で重心を求め、全面を割り当てる。
+    重心はランダムに選んだ MINIBATCH_STEPS 個のミニバッチだけで更新するので、全面で Lloyd 反復するより速い。
+    戻り値: (centroids, assignments)
+    """
+    n = len(X)
+    if PROGRESS_LOG_INTERVAL > 0:
+        print(f"  K-means 減色中（MiniBatchKMeans）: {n} 面, バッチ {MINIBATCH_BATCH_SIZE} × {MINIBATCH_STEPS} 回")
+    rng = np.random.default_rng(0)
+    model = _MiniBatchKMeans(n_clusters=k, init="k-means++", n_init=1, batch_size=MINIBATCH_BATCH_SIZE, random_state=0)
+    # fit() は毎ステップ全面を見直すので遅い。partial_fit でミニバッチだけ渡す（初回のバッチで k-means++ 初期化）
+    for _ in range(MINIBATCH_STEPS):
+        model.partial_fit(X[rng.integers(0, n, MINIBATCH_BATCH_SIZE)])
+    # predict は距離行列を作るので、メモリを抑えるため区切って割り当てる
+    assignments = np.empty(n, dtype=np.int32)
+    for start in range(0, n, MINIBATCH_PREDICT_CHUNK):
+        stop = start + MINIBATCH_PREDICT_CHUNK
+        assignments[start:stop] = model.predict(X[start:stop])
+    return model.cluster_centers_.astype(np.float32), assignments
+
+
+def quantize_colors_kmeans(face_colors, k=4, max_iter=20):
+    """
+    面の色 (N, 3) を k 色に減色（NumPy でベクトル化した k-means）。
+    戻り値: (palette: k 色のタプルのリスト, assignments: 面ごとのパレット番号（uint8 配列）)
+    """
+    # (N, 3) の float32 配列にまとめ、距離計算・重心更新を配列演算で行う
+    X = np.asarray(face_colors, dtype=np.float32).reshape(-1, 3)
+    n_fc = len(X)
+    index_dtype = _index_dtype(k)
+    if n_fc < k:
+        # 色が少ない場合はそのまま or 補完
+        pad = [(0.2, 0.2, 0.2), (0.5, 0.5, 0.5), (0.8, 0.8, 0.8)]
+        palette = [tuple(float(v) for v in c) for c in X] + pad
+        return palette[:k], np.zeros(n_fc, dtype=index_dtype)
+
+    # 異なる色がもともと k 色以下（マテリアル単位の色など）なら k-means 不要。
+    # float の誤差で別色扱いにならないよう小数 3 桁に丸めて判定する
+    unique_colors, inverse = np.unique(X.round(3), axis=0, return_inverse=True)
+    if len(unique_colors) <= k:
+        return [tuple(float(v) for v in c) for c in unique_colors], inverse.ravel().astype(index_dtype)
+
+    # クラスタリングは知覚的に均等な CIE Lab 空間で行う（RGB のままより色の分かれ方が自然）
+    use_lab = KMEANS_COLOR_SPACE == "LAB"
+    if use_lab:
+        X = _srgb_to_lab(X)
+
+    if _MiniBatchKMeans is not None and USE_MINIBATCH_KMEANS and n_fc > MINIBATCH_MIN_FACES:
+        centroids, assignments = _minibatch_kmeans(X, k)
+    else:
+        centroids, assignments = _lloyd_kmeans(X, k, max_iter)
+
+    if use_lab:
+        centroids = _lab_to_srgb(centroids)
+    return [tuple(float(v) for v in c) for c in centroids], assignments.astype(index_dtype)
 
 
 def snap_palette_to_discrete(palette, bits=8):
@@ -371,69 +611,139 @@ def snap_palette_to_discrete(palette, bits=8):
     ]
 
 
+def _distinct_colors(base, k):
+    """
+    区別しやすい色の並び base を、ちょうど k 色にそろえて返す。
+    k が base より多いときは、RGB の格子点から「選んだ色から最も遠い色」を順に足して補う。
+    """
+    if k <= len(base):
+        return list(base[:k])
+    levels = np.array([0.1, 0.4, 0.7, 0.95], dtype=np.float32)
+    candidates = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), -1).reshape(-1, 3)
+    chosen = list(base)
+    d2 = ((candidates[:, None, :] - np.asarray(chosen, dtype=np.float32)[None]) ** 2).sum(-1).min(1)
+    while len(chosen) < k:
+        i = int(d2.argmax())
+        chosen.append(tuple(float(v) for v in candidates[i]))
+        d2 = np.minimum(d2, ((candidates - candidates[i]) ** 2).sum(-1))
+    return chosen
+
+
 def ensure_distinct_palette(palette, k=4):
-    """パレットがほぼ同じ色（例: 全部白）なら、視覚的に区別しやすい4色に置き換える。"""
+    """パレットがほぼ同じ色（例: 全部白）なら、視覚的に区別しやすい k 色に置き換える。"""
     if len(palette) < k:
         palette = list(palette) + [(0.2, 0.2, 0.2)] * (k - len(palette))
-    # パレット内の明るさ・ばらつきを簡易チェック
-    lum = [0.299 * c[0] + 0.587 * c[1] + 0.114 * c[2] for c in palette]
-    avg_lum = sum(lum) / len(lum)
-    variance = sum((x - avg_lum) ** 2 for x in lum) / max(len(lum), 1)
-    # ほぼ同じ明るさで分散が小さい → 区別しやすい4色に（白っぽい or 黒っぽい）
-    if variance < 0.02 and avg_lum > 0.8:
-        return [(0.9, 0.2, 0.2), (0.2, 0.5, 0.9), (0.2, 0.75, 0.3), (0.9, 0.85, 0.2)]  # 赤・青・緑・黄
-    if variance < 0.02 and avg_lum < 0.25:
-        return [(0.9, 0.25, 0.25), (0.25, 0.5, 0.9), (0.25, 0.8, 0.35), (0.95, 0.9, 0.25)]
+    # パレット内の明るさ・ばらつきと、色どうしの最短距離を簡易チェック
+    pal = np.asarray(palette, dtype=np.float32)[:, :3]
+    lum = pal @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    avg_lum = float(lum.mean())
+    variance = float(lum.var())
+    # 明るさの分散が小さい、または RGB でほぼ重なる色の組がある → つぶれたパレットとみなす
+    pdist = np.sqrt(((pal[:, None, :] - pal[None, :, :]) ** 2).sum(-1))
+    min_pdist = float(pdist[np.triu_indices(len(pal), 1)].min()) if len(pal) > 1 else 0.0
+    collapsed = variance < 0.02 or min_pdist < PALETTE_MIN_DISTANCE
+    # 白っぽい or 黒っぽい色につぶれている → 区別しやすい色に。割り当ては 0〜k-1 のままなので必ず k 色返す
+    if collapsed and avg_lum > 0.8:
+        return _distinct_colors([(0.9, 0.2, 0.2), (0.2, 0.5, 0.9), (0.2, 0.75, 0.3), (0.9, 0.85, 0.2)], k)  # 赤・青・緑・黄
+    if collapsed and avg_lum < 0.25:
+        return _distinct_colors([(0.9, 0.25, 0.25), (0.25, 0.5, 0.9), (0.25, 0.8, 0.35), (0.95, 0.9, 0.25)], k)
     return list(palette)[:k]
 
 
-def mesh_split_by_color(obj, face_colors, assignments, palette):
-    """メッシュを色ごとに分割し、各色で新しいオブジェクトを作成。"""
-    mesh = obj.data
+def _mesh_keeping_faces(mesh, keep, name):
+    """
+    元メッシュを bmesh に読み込み、keep（面ごとの bool 配列）が False の面を C 側で削除した新しいメッシュを返す。
+    組み直す側（頂点・ループ・面を流し込む）と同じ中身になるよう、UV・頂点色などの属性、頂点グループ、
+    どの面にも使われない辺・頂点は残さない。
+    """
     bm = bmesh.new()
     bm.from_mesh(mesh)
-    bm.verts.ensure_lookup_table()
-
-    # 色インデックスごとに面をグループ化（頂点はグローバルインデックスで管理）
-    from collections import defaultdict
-    groups = defaultdict(list)  # color_index -> list of (verts_indices, face_as_vertex_indices)
-    n_faces = len(bm.faces)
-    log_interval = PROGRESS_LOG_INTERVAL if PROGRESS_LOG_INTERVAL > 0 else n_faces + 1
-    if log_interval <= n_faces:
-        print(f"  メッシュ分割: {n_faces} 面を色ごとにグループ化中")
-    for face_idx, face in enumerate(bm.faces):
-        if (face_idx + 1) % log_interval == 0 or face_idx == 0 or face_idx == n_faces - 1:
-            print(f"    面グループ化: {face_idx + 1}/{n_faces}")
-        color_idx = assignments[face_idx] if face_idx < len(assignments) else 0
-        vert_indices = [v.index for v in face.verts]
-        groups[color_idx].append(vert_indices)
-
+    doomed = [f for f, k in zip(bm.faces, keep.tolist()) if not k]
+    # FACES は面と、残りの面から使われなくなった辺・頂点だけを消す
+    bmesh.ops.delete(bm, geom=doomed, context="FACES")
+    # 元からあった面なしの辺・頂点（ルーズ）も消す
+    bmesh.ops.delete(bm, geom=[e for e in bm.edges if not e.link_faces], context="EDGES")
+    bmesh.ops.delete(bm, geom=[v for v in bm.verts if not v.link_faces], context="VERTS")
+    for layer in list(bm.verts.layers.deform.values()):
+        bm.verts.layers.deform.remove(layer)
+    new_mesh = bpy.data.meshes.new(name=name)
+    bm.to_mesh(new_mesh)
     bm.free()
+    while new_mesh.uv_layers:
+        new_mesh.uv_layers.remove(new_mesh.uv_layers[0])
+    while new_mesh.color_attributes:
+        new_mesh.color_attributes.remove(new_mesh.color_attributes[0])
+    # シャープ・シームやマテリアルインデックスなど残りのユーザー属性も外す（"." で始まる内部属性と position は必須）。
+    # マテリアルインデックスは消すと全面 0 になる（後でマテリアルを1つ追加する）
+    for attr_name in [a.name for a in new_mesh.attributes if not a.name.startswith(".") and a.name != "position"]:
+        new_mesh.attributes.remove(new_mesh.attributes[attr_name])
+    new_mesh.update()
+    return new_mesh
+
+
+def mesh_split_by_color(obj, face_colors, assignments, palette, pipeline=None):
+    """
+    メッシュを色ごとに分割し、各色で新しいオブジェクトを作成。
+    pipeline（MeshColorPipeline）を渡すと、読み込み済みのループ・頂点配列を使い回す。
+    """
+    mesh = obj.data
+    n_faces = len(mesh.polygons)
+
+    # 面のループ範囲・各ループの頂点インデックス・頂点座標（bmesh は作らない）
+    pipe = pipeline or MeshColorPipeline(obj)
+    loop_start = pipe.loop_start
+    loop_total = pipe.loop_total
+    loop_verts = pipe.loop_verts
+
+    # 色インデックスごとに面をグループ化: 色で安定ソートし、各色の区間を searchsorted で求める
+    # （assignments が面数に足りない分は色 0 扱い）。パレット番号は k ≤ 256 なら uint8 のまま扱い、
+    # NumPy の安定ソートが基数ソート（O(N)）になるようにする
+    face_color = np.zeros(n_faces, dtype=_index_dtype(len(palette)))
+    m = min(n_faces, len(assignments))
+    face_color[:m] = np.asarray(assignments)[:m]
+    n_groups = int(face_color.max()) + 1 if n_faces else 0
+    order = np.argsort(face_color, kind="stable")
+    bounds = np.searchsorted(face_color[order], np.arange(n_groups + 1))
+    if PROGRESS_LOG_INTERVAL > 0 and n_faces >= PROGRESS_LOG_INTERVAL:
+        print(f"  メッシュ分割: {n_faces} 面を色ごとにグループ化")
+
+    # 頂点座標は一括取得済みの配列から、グループごとにインデックス配列で取り出す
+    vco = pipe.vertex_co
 
     # 各グループごとにメッシュを構築
     new_objects = []
-    for color_idx, face_vert_lists in groups.items():
-        if not face_vert_lists:
+    for color_idx in range(n_groups):
+        face_idx = order[bounds[color_idx]:bounds[color_idx + 1]]
+        if not len(face_idx):
             continue
         if PROGRESS_LOG_INTERVAL > 0:
-            print(f"    色 {color_idx}: {len(face_vert_lists)} 面のメッシュ作成中")
-
-        # このグループで使う頂点のユニーク集合と、旧インデックス→新インデックス
-        all_verts = set()
-        for fv in face_vert_lists:
-            all_verts.update(fv)
-        old_to_new = {old: new for new, old in enumerate(sorted(all_verts))}
+            print(f"    色 {color_idx}: {len(face_idx)} 面のメッシュ作成中")
 
-        verts_global = list(mesh.vertices)
-        new_verts = [verts_global[i].co.copy() for i in sorted(all_verts)]
-        new_faces = [tuple(old_to_new[v] for v in fv) for fv in face_vert_lists]
-
-        new_mesh = bpy.data.meshes.new(name=f"{obj.name}_color{color_idx}")
-        new_mesh.from_pydata(new_verts, [], new_faces)
-        # 全ポリゴンにマテリアル0を割り当て（後でマテリアルを1つ追加する）
-        for poly in new_mesh.polygons:
-            poly.material_index = 0
-        new_mesh.update()
+        if len(face_idx) >= SPLIT_DELETE_MIN_RATIO * n_faces:
+            # 大半の面が残る色は、組み直すより元メッシュから他の色の面を削除する方が速い
+            new_mesh = _mesh_keeping_faces(mesh, face_color == color_idx, f"{obj.name}_color{color_idx}")
+        else:
+            # グループ内の面のループを連結した頂点インデックス列（面の並びは元の順）
+            totals = loop_total[face_idx]
+            ends = np.cumsum(totals)
+            loop_idx = np.repeat(loop_start[face_idx] - (ends - totals), totals) + np.arange(ends[-1])
+            flat = loop_verts[loop_idx]
+
+            # このグループで使う頂点のユニーク集合（昇順）と、各ループの新しい頂点インデックスを1回で求める
+            used, remapped = np.unique(flat, return_inverse=True)
+            remapped = remapped.ravel().astype(np.int32)
+
+            # from_pydata を経由せず、頂点・ループ・面の配列を直接流し込む（面の頂点数がばらばらでも同じ）
+            new_mesh = bpy.data.meshes.new(name=f"{obj.name}_color{color_idx}")
+            new_mesh.vertices.add(len(used))
+            new_mesh.vertices.foreach_set("co", vco[used].ravel())
+            new_mesh.loops.add(len(flat))
+            new_mesh.loops.foreach_set("vertex_index", remapped)
+            new_mesh.polygons.add(len(face_idx))
+            # loop_total は Blender 4.0+ では読み取り専用（次の面の loop_start から決まる）
+            new_mesh.polygons.foreach_set("loop_start", (ends - totals).astype(np.int32))
+            # 新規ポリゴンのマテリアルインデックスは 0 のまま（後でマテリアルを1つ追加する）
+            new_mesh.update(calc_edges=True)
 
         new_obj = bpy.data.objects.new(name=f"{obj.name}_color{color_idx}", object_data=new_mesh)
         new_obj.matrix_world = obj.matrix_world.copy()
@@ -459,10 +769,11 @@ def mesh_split_by_color(obj, face_colors, assignments, palette):
     return new_objects
 
 
-def apply_quantized_vertex_colors(obj, face_colors, assignments, palette, attr_name=None):
+def apply_quantized_vertex_colors(obj, face_colors, assignments, palette, attr_name=None, pipeline=None):
     """
     メッシュを分割せず、減色した色を頂点カラー（面コーナー）に書き戻す。
     1メッシュのままなので非多様体エッジは発生しない。
+    pipeline（MeshColorPipeline）を渡すと、読み込み済みのループ範囲を使い回す。
     """
     mesh = obj.data
     if not mesh.polygons or not mesh.loops:
@@ -475,42 +786,183 @@ def apply_quantized_vertex_colors(obj, face_colors, assignments, palette, attr_n
         idx = mesh.color_attributes.find(attr_name)
     if idx < 0:
         return False
+    attr = mesh.color_attributes[idx]
+    if attr.domain != "CORNER":
+        print(f"  注意: カラー属性 \"{attr_name}\" が面コーナーではないため書き戻しできません (オブジェクト: {obj.name})")
+        return False
     mesh.color_attributes.active_color_index = idx
 
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-    bm.verts.ensure_lookup_table()
-    color_layer = bm.loops.layers.color.get(attr_name)
-    if color_layer is None:
-        color_layer = bm.loops.layers.color.get("Col") or bm.loops.layers.color.get("Color")
-    if color_layer is None and bm.loops.layers.color:
-        for name, layer in bm.loops.layers.color.items():
-            color_layer = layer
-            break
-    if color_layer is None:
-        color_layer = bm.loops.layers.color.new(attr_name)
-
-    n_faces = len(bm.faces)
-    log_interval = PROGRESS_LOG_INTERVAL if PROGRESS_LOG_INTERVAL > 0 else n_faces + 1
-    for face_idx, face in enumerate(bm.faces):
-        if (face_idx + 1) % log_interval == 0 or face_idx == 0 or face_idx == n_faces - 1:
-            print(f"    頂点色書き戻し: {face_idx + 1}/{n_faces}")
-        color_idx = assignments[face_idx] if face_idx < len(assignments) else 0
-        c = palette[color_idx] if color_idx < len(palette) else (0.5, 0.5, 0.5)
-        for loop in face.loops:
-            loop[color_layer] = (c[0], c[1], c[2], 1.0)
-
-    bm.to_mesh(mesh)
+    # 面ごとの色（パレット範囲外・assignments が足りない面はグレー／色 0）をループ数ぶん繰り返し、一括で書き込む
+    pipe = pipeline or MeshColorPipeline(obj)
+    n_faces = len(mesh.polygons)
+    pal = np.ones((len(palette) + 1, 4), dtype=np.float32)
+    pal[:-1, :3] = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+    pal[-1, :3] = 0.5
+    color_idx = np.zeros(n_faces, dtype=np.int64)
+    m = min(n_faces, len(assignments))
+    color_idx[:m] = np.asarray(assignments, dtype=np.int64)[:m]
+    color_idx[(color_idx < 0) | (color_idx >= len(palette))] = len(palette)
+    print(f"    頂点色書き戻し: {n_faces} 面（一括書き込み）")
+    # 面のループは loop_start の順に連続して並んでいる（Blender 4.0+）
+    per_loop = _scratch("loop_rgba", len(mesh.loops) * 4).reshape(-1, 4)
+    np.take(pal, np.repeat(color_idx, pipe.loop_total), axis=0, out=per_loop)
+    # byte は bmesh と同じく格納値（sRGB）として書く。float は格納値そのまま
+    prop = "color" if attr.data_type == "FLOAT_COLOR" else "color_srgb"
+    attr.data.foreach_set(prop, per_loop.ravel())
     mesh.update()
-    bm.free()
     return True
 
 
+class MeshColorPipeline:
+    """
+    1オブジェクト分の「面の色取得 → 減色 → 頂点色書き戻し／分割」をまとめて扱う。
+    ループ範囲・ループの頂点インデックス・頂点座標は最初に必要になったときに
+    foreach_get で1回だけ読み込み、各段で同じ NumPy 配列を使い回す。
+    使い方: pipe = MeshColorPipeline(obj); pipe.extract(); pipe.quantize(k=4); pipe.split()
+    quantize は「analyze（NumPy のみ・スレッドから呼べる）」と「finalize_palette（bpy を触る）」に分かれる。
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.mesh = obj.data
+        self.has_vertex_color = None
+        self.face_colors = None
+        self.palette = None
+        self.assignments = None
+        self._loop_start = None
+        self._loop_total = None
+        self._loop_verts = None
+        self._vertex_co = None
+
+    def _read_polygons(self):
+        n_faces = len(self.mesh.polygons)
+        self._loop_start = np.empty(n_faces, dtype=np.int32)
+        self._loop_total = np.empty(n_faces, dtype=np.int32)
+        self.mesh.polygons.foreach_get("loop_start", self._loop_start)
+        self.mesh.polygons.foreach_get("loop_total", self._loop_total)
+
+    @property
+    def loop_start(self):
+        """各面の先頭ループのインデックス (面数,)"""
+        if self._loop_start is None:
+            self._read_polygons()
+        return self._loop_start
+
+    @property
+    def loop_total(self):
+        """各面のループ（頂点）数 (面数,)"""
+        if self._loop_total is None:
+            self._read_polygons()
+        return self._loop_total
+
+    @property
+    def loop_verts(self):
+        """各ループの頂点インデックス (ループ数,)"""
+        if self._loop_verts is None:
+            self._loop_verts = np.empty(len(self.mesh.loops), dtype=np.int32)
+            self.mesh.loops.foreach_get("vertex_index", self._loop_verts)
+        return self._loop_verts
+
+    @property
+    def vertex_co(self):
+        """頂点座標 (頂点数, 3)"""
+        if self._vertex_co is None:
+            co = np.empty(len(self.mesh.vertices) * 3, dtype=np.float32)
+            self.mesh.vertices.foreach_get("co", co)
+            self._vertex_co = co.reshape(-1, 3)
+        return self._vertex_co
+
+    def extract(self):
+        """面ごとの色 (面数, 3) を取得して保持する。1面以上取得できれば True。"""
+        self.has_vertex_color, self.face_colors = get_face_colors_from_mesh(self.obj, self)
+        return len(self.face_colors) > 0
+
+    def _sample_texture(self, texture_sample, message):
+        """テクスチャを UV で直接サンプリングし、色にばらつきがあれば face_colors を置き換える。"""
+        tex_colors = get_face_colors_from_texture(self.obj, *texture_sample)
+        if tex_colors is not None and _has_color_variance(tex_colors):
+            print(f"  {message}: {self.obj.name}")
+            self.face_colors = tex_colors
+            return True
+        return False
+
+    def keep_original_colors(self, texture_sample=(None, None, None)):
+        """減色なし: 元の色をそのまま使用（ベイクが単色ならテクスチャサンプリングを試行）。"""
+        if not _has_color_variance(self.face_colors):
+            self._sample_texture(texture_sample, "ベイクが単色だったため、テクスチャを直接サンプリング")
+        self.palette = self.face_colors
+        n_faces = len(self.face_colors)
+        self.assignments = np.arange(n_faces, dtype=_index_dtype(n_faces))
+
+    def analyze(self, k=4, max_iter=KMEANS_ITERATIONS):
+        """読み込み済みの face_colors を k 色に減色する。bpy に触れないのでワーカースレッドから呼べる。"""
+        self.palette, self.assignments = quantize_colors_kmeans(self.face_colors, k=k, max_iter=max_iter)
+
+    def finalize_palette(self, k=4, max_iter=KMEANS_ITERATIONS, texture_sample=(None, None, None)):
+        """analyze の結果を仕上げる。単色ならテクスチャを読んで再試行するのでメインスレッドで呼ぶ。"""
+        if _uses_single_color(self.assignments):
+            # ベイクが単色→テクスチャを直接サンプリングして再試行
+            if self._sample_texture(texture_sample, "ベイクが単色だったため、テクスチャを直接サンプリングして再試行"):
+                self.palette, self.assignments = quantize_colors_kmeans(self.face_colors, k=k, max_iter=max_iter)
+            if _uses_single_color(self.assignments):
+                self.assignments = (np.arange(len(self.assignments)) % k).astype(_index_dtype(k))
+                print(f"  頂点色が一色のため、面を均等に{k}色に割り当てました。（テクスチャも単色の可能性）")
+        palette = ensure_distinct_palette(self.palette, k=k)
+        self.palette = snap_palette_to_discrete(palette)
+
+    def quantize(self, k=4, max_iter=KMEANS_ITERATIONS, texture_sample=(None, None, None)):
+        """k 色に減色し、palette / assignments を保持する。"""
+        self.analyze(k=k, max_iter=max_iter)
+        self.finalize_palette(k=k, max_iter=max_iter, texture_sample=texture_sample)
+
+    def apply(self, attr_name=None):
+        """減色結果を頂点カラーに書き戻す（分割しない）。"""
+        return apply_quantized_vertex_colors(self.obj, self.face_colors, self.assignments, self.palette, attr_name, self)
+
+    def split(self):
+        """減色結果の色ごとにメッシュを分割し、作成したオブジェクトのリストを返す。"""
+        return mesh_split_by_color(self.obj, self.face_colors, self.assignments, self.palette, self)
+
+
+def extract_pipelines(objects):
+    """各オブジェクトの面の色を読み込み、面のあるものの MeshColorPipeline を返す（bpy を読むのでメインスレッドで）。"""
+    pipes = []
+    for obj in objects:
+        pipe = MeshColorPipeline(obj)
+        if pipe.extract():
+            pipes.append(pipe)
+    return pipes
+
+
+def analyze_pipelines(pipes, k=4, max_iter=KMEANS_ITERATIONS):
+    """
+    各オブジェクトの k-means（pipe.analyze）をスレッドプールで並行に実行する。
+    NumPy の演算中は GIL が外れるので、複数オブジェクト選択時に計算を重ねられる。
+    numba 版は1回の呼び出しで全コアを使うため、その場合は順に実行する。
+    """
+    workers = 1
+    if PARALLEL_OBJECTS and _assign_and_accumulate_numba is None:
+        workers = min(len(pipes), os.cpu_count() or 1)
+    if workers <= 1:
+        for pipe in pipes:
+            pipe.analyze(k=k, max_iter=max_iter)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # result() で例外をメインスレッドに伝える
+        for future in [pool.submit(pipe.analyze, k, max_iter) for pipe in pipes]:
+            future.result()
+
+
 def process_scene(output_path=None, report_fn=None, num_colors=None, prioritize_bake_over_vertex_color=None,
                  texture_sample_rotation=None, texture_sample_flip_h=None, texture_sample_flip_v=None):
     """選択メッシュをN色減色し、頂点色付き OBJ でエクスポートする。output_path が None のときは OUTPUT_PATH、num_colors が None のときは NUM_COLORS を使用。"""
     scene = bpy.context.scene
     view_layer = bpy.context.view_layer
+    # マテリアルの Base Color キャッシュは前回の実行以降に編集されている可能性があるので捨てる
+    _base_color_of.cache_clear()
+    # 選択状態はエクスポート時だけ変えるので、終わったら元に戻す（名前で保存して参照無効化を回避）
+    prev_selected_names = [o.name for o in bpy.context.selected_objects]
+    prev_active_name = view_layer.objects.active.name if view_layer.objects.active else None
 
     # 色数・保存パス・フラグ: 渡されていればそれを使用
     # n_colors=0 は減色なし（元の色をそのまま出力）
@@ -519,6 +971,7 @@ def process_scene(output_path=None, report_fn=None, num_colors=None, prioritize_
     tex_rot = texture_sample_rotation if texture_sample_rotation is not None else TEXTURE_SAMPLE_ROTATION
     tex_flip_h = texture_sample_flip_h if texture_sample_flip_h is not None else TEXTURE_SAMPLE_FLIP_H
     tex_flip_v = texture_sample_flip_v if texture_sample_flip_v is not None else TEXTURE_SAMPLE_FLIP_V
+    texture_sample = (tex_rot, tex_flip_h, tex_flip_v)
     prioritize_bake = prioritize_bake_over_vertex_color if prioritize_bake_over_vertex_color is not None else PRIORITIZE_BAKE_OVER_VERTEX_COLOR
     effective_path = (output_path or OUTPUT_PATH).rstrip()
     # OBJ のみ対応。拡張子が .obj でなければ .obj に補正する
@@ -567,9 +1020,10 @@ def process_scene(output_path=None, report_fn=None, num_colors=None, prioritize_
             if has_vcol:
                 print(f"  頂点カラーを使用（焼き込みスキップ）: {obj.name}")
             continue
-        bpy.ops.object.select_all(action="DESELECT")
-        obj.select_set(True)
-        view_layer.objects.active = obj
+        # 焼き込み優先でなければ、既存の頂点カラーに色のばらつきがあるときは時間のかかるベイクを省く
+        if has_vcol and not prioritize_bake and _vertex_color_variance(obj) > BAKE_SKIP_VARIANCE:
+            print(f"  既存の頂点カラーに色のばらつきあり→焼き込みスキップ: {obj.name}")
+            continue
         if has_vcol and not BAKE_TO_VERTEX_COLOR:
             print(f"  頂点カラーあり→焼き込みを優先: {obj.name} → 属性 \"{BAKE_TARGET_ATTR_NAME}\"")
         else:
@@ -586,37 +1040,17 @@ def process_scene(output_path=None, report_fn=None, num_colors=None, prioritize_
     if EXPORT_MODE == "vertex_color_only":
         # 分割せず、減色した色を頂点カラーに書き戻すだけ（1メッシュのまま → 非多様体回避）
         print("[調査] モード: vertex_color_only（分割せず頂点色のみ）" + (" [減色なし]" if skip_reduction else ""))
-        for obj in candidates:
-            bpy.ops.object.select_all(action="DESELECT")
-            obj.select_set(True)
-            view_layer.objects.active = obj
-            has_vcol, face_colors = get_face_colors_from_mesh(obj)
-            if not face_colors:
-                continue
+        # 面の色の読み込み（メインスレッド）→ k-means（スレッドで並行）→ 書き戻し（メインスレッド）
+        pipes = extract_pipelines(candidates)
+        if not skip_reduction:
+            analyze_pipelines(pipes, k=n_colors, max_iter=KMEANS_ITERATIONS)
+        for pipe in pipes:
+            obj = pipe.obj
             if skip_reduction:
-                # 減色なし: 元の色をそのまま使用（ベイクが単色ならテクスチャサンプリングを試行）
-                if not _has_color_variance(face_colors):
-                    tex_colors = get_face_colors_from_texture(obj, tex_rot, tex_flip_h, tex_flip_v)
-                    if tex_colors and _has_color_variance(tex_colors):
-                        print(f"  ベイクが単色だったため、テクスチャを直接サンプリング: {obj.name}")
-                        face_colors = tex_colors
-                palette = face_colors
-                assignments = list(range(len(face_colors)))
+                pipe.keep_original_colors(texture_sample)
             else:
-                palette, assignments = quantize_colors_kmeans(face_colors, k=n_colors, max_iter=KMEANS_ITERATIONS)
-                if len(set(assignments)) < 2:
-                    # ベイクが単色→テクスチャを直接サンプリングして再試行
-                    tex_colors = get_face_colors_from_texture(obj, tex_rot, tex_flip_h, tex_flip_v)
-                    if tex_colors and _has_color_variance(tex_colors):
-                        print(f"  ベイクが単色だったため、テクスチャを直接サンプリングして再試行: {obj.name}")
-                        face_colors = tex_colors
-                        palette, assignments = quantize_colors_kmeans(face_colors, k=n_colors, max_iter=KMEANS_ITERATIONS)
-                    if len(set(assignments)) < 2:
-                        assignments = [i % n_colors for i in range(len(assignments))]
-                        print(f"  頂点色が一色のため、面を均等に{n_colors}色に割り当てました。（テクスチャも単色の可能性）")
-                palette = ensure_distinct_palette(palette, k=n_colors)
-                palette = snap_palette_to_discrete(palette)
-            if apply_quantized_vertex_colors(obj, face_colors, assignments, palette):
+                pipe.finalize_palette(k=n_colors, max_iter=KMEANS_ITERATIONS, texture_sample=texture_sample)
+            if pipe.apply():
                 created.append(obj)
                 print(f"  頂点色を適用: {obj.name}")
             else:
@@ -634,46 +1068,19 @@ def process_scene(output_path=None, report_fn=None, num_colors=None, prioritize_
         # 従来: 色ごとにメッシュ分割（減色なしの場合は頂点色のみで出力）
         if skip_reduction:
             print("[調査] 減色なしのため split は不可→頂点色のみで出力します")
-            for obj in candidates:
-                bpy.ops.object.select_all(action="DESELECT")
-                obj.select_set(True)
-                view_layer.objects.active = obj
-                has_vcol, face_colors = get_face_colors_from_mesh(obj)
-                if not face_colors:
-                    continue
-                if not _has_color_variance(face_colors):
-                    tex_colors = get_face_colors_from_texture(obj, tex_rot, tex_flip_h, tex_flip_v)
-                    if tex_colors and _has_color_variance(tex_colors):
-                        print(f"  ベイクが単色だったため、テクスチャを直接サンプリング: {obj.name}")
-                        face_colors = tex_colors
-                palette = face_colors
-                assignments = list(range(len(face_colors)))
-                if apply_quantized_vertex_colors(obj, face_colors, assignments, palette):
+            for pipe in extract_pipelines(candidates):
+                obj = pipe.obj
+                pipe.keep_original_colors(texture_sample)
+                if pipe.apply():
                     created.append(obj)
                     print(f"  頂点色を適用: {obj.name}")
         else:
             print("[調査] モード: split（色ごとにメッシュ分割）")
-            for obj in candidates:
-                bpy.ops.object.select_all(action="DESELECT")
-                obj.select_set(True)
-                view_layer.objects.active = obj
-                has_vcol, face_colors = get_face_colors_from_mesh(obj)
-                if not face_colors:
-                    continue
-                palette, assignments = quantize_colors_kmeans(face_colors, k=NUM_COLORS, max_iter=KMEANS_ITERATIONS)
-                if len(set(assignments)) < 2:
-                    tex_colors = get_face_colors_from_texture(obj, tex_rot, tex_flip_h, tex_flip_v)
-                    if tex_colors and _has_color_variance(tex_colors):
-                        print(f"  ベイクが単色だったため、テクスチャを直接サンプリングして再試行: {obj.name}")
-                        face_colors = tex_colors
-                        palette, assignments = quantize_colors_kmeans(face_colors, k=NUM_COLORS, max_iter=KMEANS_ITERATIONS)
-                    if len(set(assignments)) < 2:
-                        assignments = [i % NUM_COLORS for i in range(len(assignments))]
-                        print("  頂点色が一色のため、面を均等に4分割しました。（テクスチャも単色の可能性）")
-                palette = ensure_distinct_palette(palette, k=NUM_COLORS)
-                palette = snap_palette_to_discrete(palette)
-                new_objs = mesh_split_by_color(obj, face_colors, assignments, palette)
-                created.extend(new_objs)
+            pipes = extract_pipelines(candidates)
+            analyze_pipelines(pipes, k=n_colors, max_iter=KMEANS_ITERATIONS)
+            for pipe in pipes:
+                pipe.finalize_palette(k=n_colors, max_iter=KMEANS_ITERATIONS, texture_sample=texture_sample)
+                created.extend(pipe.split())
         if not created:
             msg = "分割できるメッシュがありません。" if not skip_reduction else "頂点色を適用できるメッシュがありません。"
             print(msg)
@@ -686,14 +1093,10 @@ def process_scene(output_path=None, report_fn=None, num_colors=None, prioritize_
     if EXPORT_MODE != "vertex_color_only":
         for i, o in enumerate(created):
             mat_info = ""
-            if o.data.materials:
-                mat = o.data.materials[0]
-                if mat and mat.node_tree and mat.node_tree.nodes:
-                    for n in mat.node_tree.nodes:
-                        if n.type == "BSDF_PRINCIPLED":
-                            col = n.inputs["Base Color"].default_value
-                            mat_info = f" RGB({col[0]:.2f},{col[1]:.2f},{col[2]:.2f})"
-                            break
+            if o.data.materials and o.data.materials[0]:
+                col = _base_color_of(o.data.materials[0].name)
+                if col is not None:
+                    mat_info = f" RGB({col[0]:.2f},{col[1]:.2f},{col[2]:.2f})"
             print(f"  - [{i}] {o.name}{mat_info}")
 
     # 分割モード時のみ「元の候補オブジェクト」をシーンから外す（エクスポート対象に含めない）
@@ -829,6 +1232,13 @@ def process_scene(output_path=None, report_fn=None, num_colors=None, prioritize_
             except ReferenceError:
                 pass
         print("[調査] 元オブジェクトをコレクションに戻しました。")
+        # 実行前の選択・アクティブを復元
+        for name in prev_selected_names:
+            obj = bpy.data.objects.get(name)
+            if obj is not None and view_layer.objects.get(name) is not None:
+                obj.select_set(True)
+        if prev_active_name and view_layer.objects.get(prev_active_name) is not None:
+            view_layer.objects.active = view_layer.objects[prev_active_name]
 
 
 class EXPORT_OT_4color(bpy.types.Operator, ExportHelper):
@@ -0,0 +1,359 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+PNG 減色ツールの共通コア（K-means パレット算出・Floyd–Steinberg ディザ・ディザなしの置き換え）。
+
+reduce_color_png.py（CLI）と reduce_color_png_blender.py（Blender）の両方から読み込んで使う。
+NumPy が必要。numba があれば K-means の割り当てとディザのループを JIT で高速化する
+（cache=True のコンパイル結果もこのモジュールの分を両方で共有する）。
+"""
+
+from functools import partial
+
+import numpy as np
+
+try:
+    # 任意: numba があれば K-means の割り当てとディザのループを JIT で高速化（なければ NumPy / Python のまま）
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+def _kmeans_assign_kernel(pts, weights, centroids):
+    """
+    K-means の割り当てと集計を 1 パスで行う（numba で njit(parallel=True) して使う）。
+    (N, k) の距離行列は作らず、色を固定数のチャンクに分けて並列処理し、チャンクごとの部分和を最後に足す。
+    weights は各色のピクセル数（合計・個数はこの重みで数える）。
+    戻り値: (labels, sums (k, 3), counts (k,), 各色の最近傍重心までの二乗距離)
+    """
+    n = pts.shape[0]
+    k = centroids.shape[0]
+    n_chunks = min(n, 256)
+    labels = np.empty(n, dtype=np.int64)
+    nearest_d2 = np.empty(n, dtype=np.float32)
+    part_sums = np.zeros((n_chunks, k, 3))
+    part_counts = np.zeros((n_chunks, k))
+    for c in prange(n_chunks):
+        lo = c * n // n_chunks
+        hi = (c + 1) * n // n_chunks
+        for i in range(lo, hi):
+            r = pts[i, 0]
+            g = pts[i, 1]
+            b = pts[i, 2]
+            best = 0
+            best_d2 = (r - centroids[0, 0]) ** 2 + (g - centroids[0, 1]) ** 2 + (b - centroids[0, 2]) ** 2
+            for j in range(1, k):
+                d2 = (r - centroids[j, 0]) ** 2 + (g - centroids[j, 1]) ** 2 + (b - centroids[j, 2]) ** 2
+                if d2 < best_d2:
+                    best_d2 = d2
+                    best = j
+            labels[i] = best
+            nearest_d2[i] = best_d2
+            w = weights[i]
+            part_sums[c, best, 0] += r * w
+            part_sums[c, best, 1] += g * w
+            part_sums[c, best, 2] += b * w
+            part_counts[c, best] += w
+    return labels, part_sums.sum(axis=0), part_counts.sum(axis=0), nearest_d2
+
+
+_kmeans_assign_jit = None
+if njit is not None:
+    try:
+        _kmeans_assign_jit = njit(parallel=True, fastmath=True, cache=True)(_kmeans_assign_kernel)
+    except RuntimeError:
+        # キャッシュ先がないときはキャッシュなしで JIT
+        _kmeans_assign_jit = njit(parallel=True, fastmath=True)(_kmeans_assign_kernel)
+
+
+def _kmeans_assign_numpy(pts, weights, centroids, pts_sq):
+    """_kmeans_assign_kernel の NumPy 版。二乗距離は |p|² + |c|² - 2 p·cᵀ で求める（大小比較だけなので sqrt 不要）。"""
+    k = len(centroids)
+    # |p|² は行ごとの定数で argmin を変えないので、選ばれた距離にだけ足す
+    d2_shifted = (centroids * centroids).sum(1)[None, :] - 2.0 * (pts @ centroids.T)
+    labels = d2_shifted.argmin(1)
+    counts = np.bincount(labels, weights=weights, minlength=k)
+    sums = np.stack([np.bincount(labels, weights=pts[:, t] * weights, minlength=k) for t in range(3)], axis=1)
+    nearest_d2 = np.take_along_axis(d2_shifted, labels[:, None], axis=1)[:, 0] + pts_sq
+    return labels, sums, counts, nearest_d2
+
+
+def kmeans_palette(pixels_rgb, k, max_iter=30):
+    """
+    RGB のピクセル列から k 色のパレットを K-means で求める（NumPy でベクトル化）。
+    pixels_rgb: (N, 3) の配列、または (r,g,b) のリスト。各 0..255
+    戻り値: list of (r,g,b) 0..255 のパレット
+    """
+    pts = np.asarray(pixels_rgb).reshape(-1, 3)
+    if len(pts) < k:
+        # 色が少ない場合は補完
+        base = [tuple(int(v) for v in p) for p in pts]
+        while len(base) < k:
+            v = int(255 * (len(base) + 1) / (k + 1))
+            base.append((v, v, v))
+        return base[:k]
+
+    # 同じ色のピクセルはまとめ、ピクセル数を重みにして K-means する（ベタ塗りの多いテクスチャでは点数が大きく減る）
+    # (r,g,b) を 1 つの uint32 にまとめて 1 次元の np.unique にかける（axis=0 の unique より桁違いに速い）
+    rgb = np.clip(pts, 0, 255).astype(np.uint32)
+    keys, counts = np.unique((rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2], return_counts=True)
+    colors = np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=1)
+    weights = counts.astype(np.float64)
+
+    # 0..1 で扱う（距離計算を合わせる）
+    pts = colors.astype(np.float32) / np.float32(255.0)
+    n = len(pts)
+
+    # k-means++ 初期化: 既に選んだ重心までの最短二乗距離（×ピクセル数）に比例した確率で次の重心を選ぶ（乱数は固定）
+    rng = np.random.default_rng(0)
+    centroids = np.empty((k, 3), dtype=np.float32)
+    centroids[0] = pts[rng.choice(n, p=weights / weights.sum())]
+    closest = ((pts - centroids[0]) ** 2).sum(1)
+    for j in range(1, k):
+        score = closest * weights
+        total = float(score.sum())
+        idx = rng.choice(n, p=score / total) if total > 0.0 else rng.integers(n)
+        centroids[j] = pts[idx]
+        closest = np.minimum(closest, ((pts - centroids[j]) ** 2).sum(1))
+
+    # 割り当て＋集計: numba があれば並列カーネル、なければ NumPy（|p|² は反復中に変わらないので1回だけ計算）
+    if _kmeans_assign_jit is not None:
+        assign = _kmeans_assign_jit
+    else:
+        assign = partial(_kmeans_assign_numpy, pts_sq=(pts * pts).sum(1))
+    assignments = None
+    for _ in range(max_iter):
+        new_assignments, sums, counts, nearest_d2 = assign(pts, weights, centroids)
+        if assignments is not None and np.array_equal(new_assignments, assignments):
+            break
+        assignments = new_assignments
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # 空になった色は、いまの重心からいちばん遠い色に置き直す
+        if not filled.all():
+            for j in np.flatnonzero(~filled):
+                far = int(nearest_d2.argmax())
+                centroids[j] = pts[far]
+                nearest_d2[far] = -1.0
+
+    return [tuple(int(v) for v in c) for c in np.clip(np.round(centroids * 255.0), 0, 255)]
+
+
+def nearest_palette_index(r, g, b, palette):
+    """RGB に最も近いパレットのインデックスを返す。"""
+    best_i = 0
+    best_d = (r - palette[0][0]) ** 2 + (g - palette[0][1]) ** 2 + (b - palette[0][2]) ** 2
+    for i in range(1, len(palette)):
+        pr, pg, pb = palette[i]
+        d = (r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2
+        if d < best_d:
+            best_d, best_i = d, i
+    return best_i
+
+
+def quantize_to_palette(rgb, palette, colors_per_chunk=65536):
+    """
+    画像 (H, W, 3) uint8 の各ピクセルを最も近いパレット色に置き換えた (H, W, 3) uint8 を返す（ディザなし）。
+    画像に現れる色ごとに一度だけ最近傍を求め（ベタ塗りが多いほど速い）、色キーの表引きで全ピクセルに展開する。
+    最近傍の計算は colors_per_chunk 色ずつ配列演算でまとめて行い、(色数, K) の中間配列を小さく保つ。
+    """
+    pal = np.asarray(palette, dtype=np.int32).reshape(-1, 3)
+    # (r,g,b) を 1 つの uint32 キーにまとめ、画像に出てくる色だけを 2^24 の表で洗い出す（ソート不要の 1 パス）
+    rgb32 = np.asarray(rgb).reshape(-1, 3).astype(np.uint32)
+    keys = (rgb32[:, 0] << 16) | (rgb32[:, 1] << 8) | rgb32[:, 2]
+    present = np.zeros(1 << 24, dtype=bool)
+    present[keys] = True
+    colors = np.flatnonzero(present).astype(np.uint32)
+    # 出てくる色ごとに最近傍のパレット番号を求め、キー → 番号の表にする
+    table = np.zeros(1 << 24, dtype=np.uint8 if len(pal) <= 256 else np.int32)
+    for i0 in range(0, len(colors), colors_per_chunk):
+        c = colors[i0:i0 + colors_per_chunk]
+        block = np.stack([c >> 16, (c >> 8) & 0xFF, c & 0xFF], axis=1).astype(np.int32)
+        diff = block[:, None, :] - pal[None, :, :]
+        table[c] = (diff * diff).sum(-1).argmin(-1)
+    return pal.astype(np.uint8)[table[keys]].reshape(np.shape(rgb)[:2] + (3,))
+
+
+def _fs_dither_kernel(f, alpha, pal, out, carry):
+    """
+    Floyd–Steinberg ディザの本体（numba で njit して使う）。
+    f: (h, W, 3) float64 の作業バッファ（行タイル。誤差を足し込むので上書きされる）, pal: (K, 3) int32, out: (h, W, 3) uint8
+    carry: (W, 3) float64。タイル最終行から次のタイル先頭行へ渡す誤差をここに足し込む
+    alpha: (h, W) uint8。完全に透明（0）なピクセルは色を探さず (0,0,0) にし、誤差も拡散しない
+    """
+    height = f.shape[0]
+    width = f.shape[1]
+    k = pal.shape[0]
+    for y in range(height):
+        # 蛇行走査: 偶数行は左→右、奇数行は右→左（誤差の拡散方向も反転）
+        if y & 1 == 0:
+            x_start, x_stop, dx = 0, width, 1
+        else:
+            x_start, x_stop, dx = width - 1, -1, -1
+        for x in range(x_start, x_stop, dx):
+            if alpha[y, x] == 0:
+                out[y, x, 0] = 0
+                out[y, x, 1] = 0
+                out[y, x, 2] = 0
+                continue
+            # 0..255 に飽和させてから四捨五入（round と min/max の呼び出しを使わない）
+            v = f[y, x, 0]
+            r = 0 if v <= 0.0 else (255 if v >= 255.0 else int(v + 0.5))
+            v = f[y, x, 1]
+            g = 0 if v <= 0.0 else (255 if v >= 255.0 else int(v + 0.5))
+            v = f[y, x, 2]
+            b = 0 if v <= 0.0 else (255 if v >= 255.0 else int(v + 0.5))
+            # 最も近いパレット色
+            best_i = 0
+            best_d = (r - pal[0, 0]) ** 2 + (g - pal[0, 1]) ** 2 + (b - pal[0, 2]) ** 2
+            for i in range(1, k):
+                d = (r - pal[i, 0]) ** 2 + (g - pal[i, 1]) ** 2 + (b - pal[i, 2]) ** 2
+                if d < best_d:
+                    best_d = d
+                    best_i = i
+            pr = pal[best_i, 0]
+            pg = pal[best_i, 1]
+            pb = pal[best_i, 2]
+            out[y, x, 0] = pr
+            out[y, x, 1] = pg
+            out[y, x, 2] = pb
+            # 誤差
+            er = f[y, x, 0] - pr
+            eg = f[y, x, 1] - pg
+            eb = f[y, x, 2] - pb
+            # Floyd–Steinberg 係数（進行方向基準）: 前 7/16, 後ろ下 3/16, 下 5/16, 前下 1/16
+            xf = x + dx
+            xb = x - dx
+            if 0 <= xf < width:
+                f[y, xf, 0] += er * 7 / 16
+                f[y, xf, 1] += eg * 7 / 16
+                f[y, xf, 2] += eb * 7 / 16
+            # 下の行（タイルの最終行なら次のタイルへの繰り越し）
+            if y + 1 < height:
+                below = f[y + 1]
+            else:
+                below = carry
+            below[x, 0] += er * 5 / 16
+            below[x, 1] += eg * 5 / 16
+            below[x, 2] += eb * 5 / 16
+            if 0 <= xb < width:
+                below[xb, 0] += er * 3 / 16
+                below[xb, 1] += eg * 3 / 16
+                below[xb, 2] += eb * 3 / 16
+            if 0 <= xf < width:
+                below[xf, 0] += er * 1 / 16
+                below[xf, 1] += eg * 1 / 16
+                below[xf, 2] += eb * 1 / 16
+
+
+_fs_dither_jit = None
+if njit is not None:
+    try:
+        _fs_dither_jit = njit(fastmath=True, cache=True)(_fs_dither_kernel)
+    except RuntimeError:
+        # キャッシュ先がない（テキストエディタから実行した等）ときはキャッシュなしで JIT
+        _fs_dither_jit = njit(fastmath=True)(_fs_dither_kernel)
+
+
+def floyd_steinberg_dither(img_rgb, palette, width, height, alpha=None, tile_rows=64):
+    """
+    画像（(H, W, 3) 配列 または RGB の 2D リスト、値は 0..255）をパレットで Floyd–Steinberg ディザする。
+    numba があれば JIT したカーネルで、なければ Python のループで処理する。
+    numba 版は tile_rows 行ずつ処理し、float の作業バッファを (tile_rows, W, 3) に抑える。
+    alpha（(H, W)、省略可）が 0 の完全に透明なピクセルは色を探さず (0,0,0) とし、そこからは誤差を拡散しない。
+    戻り値: 出力ピクセルの (H, W, 3) uint8 配列
+    """
+    if alpha is None:
+        alpha = np.full((height, width), 255, dtype=np.uint8)
+    alpha = np.asarray(alpha, dtype=np.uint8).reshape(height, width)
+    if _fs_dither_jit is None:
+        rows = np.asarray(img_rgb).reshape(height, width, 3).tolist()
+        return np.asarray(_floyd_steinberg_dither_py(rows, palette, width, height, alpha.tolist()), dtype=np.uint8)
+    rgb = np.asarray(img_rgb).reshape(height, width, 3)
+    pal = np.asarray(palette, dtype=np.int32).reshape(-1, 3)
+    out = np.empty((height, width, 3), dtype=np.uint8)
+    # float の作業バッファは tile_rows 行ずつだけ作り、タイル境界の誤差は carry で次へ渡す
+    # （蛇行走査の偶奇を保つため行数は偶数にそろえる）
+    tile_rows = max(2, tile_rows + (tile_rows & 1))
+    carry = np.zeros((width, 3), dtype=np.float64)
+    for y0 in range(0, height, tile_rows):
+        f = rgb[y0:y0 + tile_rows].astype(np.float64)
+        f[0] += carry
+        carry[:] = 0.0
+        _fs_dither_jit(f, alpha[y0:y0 + tile_rows], pal, out[y0:y0 + tile_rows], carry)
+    return out
+
+
+def _floyd_steinberg_dither_py(img_rgb, palette, width, height, alpha):
+    """
+    floyd_steinberg_dither の Python 版（numba がないとき用）。
+    誤差拡散用に float で作業し、出力ピクセル (R,G,B) の 2D リストを返す。alpha は (H, W) の 2D リスト。
+    """
+    f = [[[float(img_rgb[y][x][c]) for c in range(3)] for x in range(width)] for y in range(height)]
+
+    out = [[(0, 0, 0) for _ in range(width)] for _ in range(height)]
+
+    for y in range(height):
+        # 蛇行走査（numba 版と同じ順序）
+        dx = 1 if y % 2 == 0 else -1
+        for x in (range(width) if dx == 1 else range(width - 1, -1, -1)):
+            if alpha[y][x] == 0:
+                continue
+            v = f[y][x][0]
+            r = 0 if v <= 0.0 else (255 if v >= 255.0 else int(v + 0.5))
+            v = f[y][x][1]
+            g = 0 if v <= 0.0 else (255 if v >= 255.0 else int(v + 0.5))
+            v = f[y][x][2]
+            b = 0 if v <= 0.0 else (255 if v >= 255.0 else int(v + 0.5))
+            idx = nearest_palette_index(r, g, b, palette)
+            pr, pg, pb = palette[idx]
+            out[y][x] = (pr, pg, pb)
+            # 誤差
+            er = f[y][x][0] - pr
+            eg = f[y][x][1] - pg
+            eb = f[y][x][2] - pb
+            # Floyd–Steinberg 係数（進行方向基準）: 前 7/16, 後ろ下 3/16, 下 5/16, 前下 1/16
+            xf = x + dx
+            xb = x - dx
+            if 0 <= xf < width:
+                f[y][xf][0] += er * 7 / 16
+                f[y][xf][1] += eg * 7 / 16
+                f[y][xf][2] += eb * 7 / 16
+            if y + 1 < height:
+                f[y + 1][x][0] += er * 5 / 16
+                f[y + 1][x][1] += eg * 5 / 16
+                f[y + 1][x][2] += eb * 5 / 16
+                if 0 <= xb < width:
+                    f[y + 1][xb][0] += er * 3 / 16
+                    f[y + 1][xb][1] += eg * 3 / 16
+                    f[y + 1][xb][2] += eb * 3 / 16
+                if 0 <= xf < width:
+                    f[y + 1][xf][0] += er * 1 / 16
+                    f[y + 1][xf][1] += eg * 1 / 16
+                    f[y + 1][xf][2] += eb * 1 / 16
+    return out
+
+
+def reduce_color_from_arrays(rgb, alpha, width, height, num_colors, use_dither, max_pixels_for_palette=500000, kmeans_iterations=30):
+    """
+    rgb: (height, width, 3) uint8, alpha: (height, width) uint8
+    返り値: out_rgb（(height, width, 3) uint8）, およびパレット（参考用）
+    """
+    # 不透明部分の RGB だけをパレット計算に使う（なければ全ピクセル）
+    rgb_for_palette = rgb[alpha >= 128]
+    if not len(rgb_for_palette):
+        rgb_for_palette = rgb.reshape(-1, 3)
+    if len(rgb_for_palette) > max_pixels_for_palette:
+        # 先頭から等間隔ではなく、画像全体から重複なしでランダムに抜き出す（再現性のためシード固定）
+        idx = np.random.default_rng(0).choice(len(rgb_for_palette), max_pixels_for_palette, replace=False)
+        rgb_for_palette = rgb_for_palette[idx]
+
+    palette = kmeans_palette(rgb_for_palette, num_colors, max_iter=kmeans_iterations)
+
+    if use_dither:
+        out_rgb = floyd_steinberg_dither(rgb, palette, width, height, alpha=alpha)
+    else:
+        # ディザなしは全ピクセル独立なので配列でまとめて最近傍色に置き換える
+        out_rgb = quantize_to_palette(rgb, palette)
+
+    return out_rgb, palette
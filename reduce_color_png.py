@@ -17,109 +17,43 @@ except ImportError:
     print("Pillow が必要です: pip install Pillow")
     raise SystemExit(1)
 
+try:
+    import numpy as np
+except ImportError:
+    print("NumPy が必要です: pip install numpy")
+    raise SystemExit(1)
 
-def kmeans_palette(pixels_rgb, k, max_iter=30):
-    """
-    RGB のピクセルリストから k 色のパレットを K-means で求める。
-    pixels_rgb: list of (r,g,b) 各 0..255
-    戻り値: list of (r,g,b) 0..255 のパレット
-    """
-    if not pixels_rgb or len(pixels_rgb) < k:
-        # 色が少ない場合は補完
-        base = list(pixels_rgb) if pixels_rgb else []
-        while len(base) < k:
-            v = int(255 * (len(base) + 1) / (k + 1))
-            base.append((v, v, v))
-        return base[:k]
-
-    # 0..1 で扱う（距離計算を合わせる）
-    pts = [(r / 255.0, g / 255.0, b / 255.0) for r, g, b in pixels_rgb]
-    step = max(1, len(pts) // k)
-    centroids = [pts[i] for i in range(0, len(pts), step)][:k]
-    while len(centroids) < k:
-        centroids.append((0.0, 0.0, 0.0))
-
-    def dist(a, b):
-        return sum((x - y) ** 2 for x, y in zip(a, b)) ** 0.5
-
-    assignments = [0] * len(pts)
-    for _ in range(max_iter):
-        for i, c in enumerate(pts):
-            best_j = 0
-            best_d = dist(c, centroids[0])
-            for j in range(1, k):
-                d = dist(c, centroids[j])
-                if d < best_d:
-                    best_d, best_j = d, j
-            assignments[i] = best_j
-        new_c = [[0.0, 0.0, 0.0] for _ in range(k)]
-        counts = [0] * k
-        for i, c in enumerate(pts):
-            j = assignments[i]
-            for t in range(3):
-                new_c[j][t] += c[t]
-            counts[j] += 1
-        for j in range(k):
-            if counts[j] > 0:
-                centroids[j] = tuple(new_c[j][t] / counts[j] for t in range(3))
-
-    return [
-        (round(centroids[j][0] * 255), round(centroids[j][1] * 255), round(centroids[j][2] * 255))
-        for j in range(k)
-    ]
-
-
-def nearest_palette_index(r, g, b, palette):
-    """RGB に最も近いパレットのインデックスを返す。"""
-    best_i = 0
-    best_d = (r - palette[0][0]) ** 2 + (g - palette[0][1]) ** 2 + (b - palette[0][2]) ** 2
-    for i in range(1, len(palette)):
-        pr, pg, pb = palette[i]
-        d = (r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2
-        if d < best_d:
-            best_d, best_i = d, i
-    return best_i
-
-
-def floyd_steinberg_dither(img_rgb, palette, width, height):
+from reduce_color_core import reduce_color_from_arrays
+
+
+def _reduce_with_kmeans(img, num_colors, use_dither, max_pixels_for_palette, kmeans_iterations):
+    """RGBA 画像を K-means パレット＋（任意で）Floyd–Steinberg ディザで減色した RGBA 画像を返す。"""
+    width, height = img.size
+    rgba = np.asarray(img)  # (H, W, 4) uint8
+    out_rgb, _ = reduce_color_from_arrays(
+        rgba[:, :, :3], rgba[:, :, 3], width, height, num_colors, use_dither,
+        max_pixels_for_palette=max_pixels_for_palette, kmeans_iterations=kmeans_iterations,
+    )
+
+    # 出力は (H, W, 4) の配列 1 枚に書き込み、アルファは入力のまま
+    out = np.empty((height, width, 4), dtype=np.uint8)
+    out[:, :, :3] = out_rgb
+    out[:, :, 3] = rgba[:, :, 3]
+    return Image.fromarray(out)
+
+
+def _reduce_with_pil(img, num_colors, use_dither, kmeans_iterations):
     """
-    画像（RGB の 2D リスト、値は 0..255）をパレットで Floyd–Steinberg ディザする。
-    誤差拡散用に float で作業し、出力ピクセル (R,G,B) の 2D リストを返す。
+    RGBA 画像を Pillow の Image.quantize（メディアンカット＋ディザ、C 実装）で減色した RGBA 画像を返す。
+    K-means 版より大幅に速いが、パレットは K-means 版と一致しない。アルファはそのまま維持。
     """
-    f = [[[float(img_rgb[y][x][c]) for c in range(3)] for x in range(width)] for y in range(height)]
-
-    out = [[(0, 0, 0) for _ in range(width)] for _ in range(height)]
-
-    for y in range(height):
-        for x in range(width):
-            r = max(0, min(255, round(f[y][x][0])))
-            g = max(0, min(255, round(f[y][x][1])))
-            b = max(0, min(255, round(f[y][x][2])))
-            idx = nearest_palette_index(r, g, b, palette)
-            pr, pg, pb = palette[idx]
-            out[y][x] = (pr, pg, pb)
-            # 誤差
-            er = f[y][x][0] - pr
-            eg = f[y][x][1] - pg
-            eb = f[y][x][2] - pb
-            # Floyd–Steinberg 係数: 右 7/16, 左下 3/16, 下 5/16, 右下 1/16
-            if x + 1 < width:
-                f[y][x + 1][0] += er * 7 / 16
-                f[y][x + 1][1] += eg * 7 / 16
-                f[y][x + 1][2] += eb * 7 / 16
-            if y + 1 < height:
-                f[y + 1][x][0] += er * 5 / 16
-                f[y + 1][x][1] += eg * 5 / 16
-                f[y + 1][x][2] += eb * 5 / 16
-                if x - 1 >= 0:
-                    f[y + 1][x - 1][0] += er * 3 / 16
-                    f[y + 1][x - 1][1] += eg * 3 / 16
-                    f[y + 1][x - 1][2] += eb * 3 / 16
-                if x + 1 < width:
-                    f[y + 1][x + 1][0] += er * 1 / 16
-                    f[y + 1][x + 1][1] += eg * 1 / 16
-                    f[y + 1][x + 1][2] += eb * 1 / 16
-    return out
+    dither = Image.Dither.FLOYDSTEINBERG if use_dither else Image.Dither.NONE
+    quantized = img.convert("RGB").quantize(
+        colors=num_colors, method=Image.Quantize.MEDIANCUT, kmeans=kmeans_iterations, dither=dither
+    )
+    out_img = quantized.convert("RGBA")
+    out_img.putalpha(img.getchannel("A"))
+    return out_img
 
 
 def reduce_color_png(
@@ -129,6 +63,7 @@ def reduce_color_png(
     use_dither: bool = True,
     max_pixels_for_palette: int = 500_000,
     kmeans_iterations: int = 30,
+    engine: str = "kmeans",
 ) -> Path:
     """
     PNG を指定色数に減色し、必要に応じてディザをかけて保存する。
@@ -139,57 +74,21 @@ def reduce_color_png(
     - use_dither: True で Floyd–Steinberg ディザを使用
     - max_pixels_for_palette: パレット計算に使う最大ピクセル数（大きい画像用）
     - kmeans_iterations: K-means の反復回数
+    - engine: "kmeans"（K-means パレット＋本ツールのディザ）または "pil"（Pillow の quantize で高速に処理）
 
     戻り値: 保存したファイルの Path
     """
+    if engine not in ("kmeans", "pil"):
+        raise ValueError(f"engine は 'kmeans' か 'pil' を指定してください: {engine}")
     path = Path(input_path).resolve()
     if not path.exists():
         raise FileNotFoundError(f"ファイルが見つかりません: {path}")
 
     img = Image.open(path).convert("RGBA")
-    width, height = img.size
-    pixels = list(img.getdata())
-
-    # 不透明部分の RGB だけをパレット計算に使う（透明は黒として扱わず、サンプルから外すこともできる）
-    rgb_for_palette = []
-    for i, (r, g, b, a) in enumerate(pixels):
-        if a < 128:
-            continue
-        rgb_for_palette.append((r, g, b))
-    if not rgb_for_palette:
-        rgb_for_palette = [(r, g, b) for r, g, b, a in pixels]
-
-    # ピクセル数が多すぎる場合はサンプリング
-    if len(rgb_for_palette) > max_pixels_for_palette:
-        step = len(rgb_for_palette) // max_pixels_for_palette
-        rgb_for_palette = rgb_for_palette[::step]
-
-    palette = kmeans_palette(rgb_for_palette, num_colors, max_iter=kmeans_iterations)
-
-    # 画像を 2D RGB リストに（アルファは別で保持）
-    rgb_2d = [[(pixels[y * width + x][0], pixels[y * width + x][1], pixels[y * width + x][2]) for x in range(width)] for y in range(height)]
-    alpha_2d = [[pixels[y * width + x][3] for x in range(width)] for y in range(height)]
-
-    if use_dither:
-        out_rgb_2d = floyd_steinberg_dither(rgb_2d, palette, width, height)
+    if engine == "pil":
+        out_img = _reduce_with_pil(img, num_colors, use_dither, kmeans_iterations)
     else:
-        out_rgb_2d = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                r, g, b = rgb_2d[y][x]
-                idx = nearest_palette_index(r, g, b, palette)
-                row.append(palette[idx])
-            out_rgb_2d.append(row)
-
-    # RGBA に戻して保存
-    out_pixels = [
-        (out_rgb_2d[y][x][0], out_rgb_2d[y][x][1], out_rgb_2d[y][x][2], alpha_2d[y][x])
-        for y in range(height)
-        for x in range(width)
-    ]
-    out_img = Image.new("RGBA", (width, height))
-    out_img.putdata(out_pixels)
+        out_img = _reduce_with_kmeans(img, num_colors, use_dither, max_pixels_for_palette, kmeans_iterations)
 
     out_path = Path(output_path).resolve() if output_path else path.parent / f"{path.stem}_{num_colors}color.png"
     out_path.parent.mkdir(parents=True, exist_ok=True)
@@ -234,6 +133,12 @@ def main():
         metavar="N",
         help="K-means の反復回数（デフォルト: 30）",
     )
+    parser.add_argument(
+        "--engine",
+        choices=("kmeans", "pil"),
+        default="kmeans",
+        help="減色エンジン。kmeans: K-means パレット（デフォルト）, pil: Pillow の quantize で高速に処理",
+    )
     args = parser.parse_args()
 
     if args.colors < 2:
@@ -246,6 +151,7 @@ def main():
         use_dither=not args.no_dither,
         max_pixels_for_palette=args.max_pixels,
         kmeans_iterations=args.kmeans_iterations,
+        engine=args.engine,
     )
     print(f"保存しました: {out}")
 
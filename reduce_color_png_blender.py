@@ -3,7 +3,7 @@
 Blender 上で動く「PNG 減色＋ディザ」ツール。
 
 - スクリプト → ファイルを開く → 本ファイルを選択 → スクリプトを実行
-- またはテキストエディタに貼り付けて実行
+  （減色処理は同じフォルダの reduce_color_core.py を読み込むので、2 ファイルを並べて置いておく）
 - 実行後、UV/画像エディタの「画像」メニューに「画像を減色（指定色数＋ディザ）」が追加されます。
   メニューから実行するか、下記の if __name__ で INVOKE_DEFAULT を呼ぶとファイル選択ダイアログが開きます。
   どこからでも F3 で「減色」と検索して実行できます。
@@ -12,140 +12,18 @@ Blender 標準の画像 API のみ使用（Pillow 不要）。
 """
 
 import os
+import sys
 
 import bpy
+import numpy as np
 from bpy_extras.io_utils import ImportHelper
 
+# 共通コア（reduce_color_core.py）は本ファイルと同じフォルダに置く
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_DIR not in sys.path:
+    sys.path.append(_SCRIPT_DIR)
 
-# ---------- 減色コア（CLI 版と同じロジック） ----------
-
-def kmeans_palette(pixels_rgb, k, max_iter=30):
-    """RGB のピクセルリストから k 色のパレットを K-means で求める。各 0..255。"""
-    if not pixels_rgb or len(pixels_rgb) < k:
-        base = list(pixels_rgb) if pixels_rgb else []
-        while len(base) < k:
-            v = int(255 * (len(base) + 1) / (k + 1))
-            base.append((v, v, v))
-        return base[:k]
-
-    pts = [(r / 255.0, g / 255.0, b / 255.0) for r, g, b in pixels_rgb]
-    step = max(1, len(pts) // k)
-    centroids = [list(pts[i]) for i in range(0, len(pts), step)][:k]
-    while len(centroids) < k:
-        centroids.append([0.0, 0.0, 0.0])
-
-    def dist(a, b):
-        return sum((x - y) ** 2 for x, y in zip(a, b)) ** 0.5
-
-    assignments = [0] * len(pts)
-    for _ in range(max_iter):
-        for i, c in enumerate(pts):
-            best_j = 0
-            best_d = dist(c, centroids[0])
-            for j in range(1, k):
-                d = dist(c, centroids[j])
-                if d < best_d:
-                    best_d, best_j = d, j
-            assignments[i] = best_j
-        new_c = [[0.0, 0.0, 0.0] for _ in range(k)]
-        counts = [0] * k
-        for i, c in enumerate(pts):
-            j = assignments[i]
-            for t in range(3):
-                new_c[j][t] += c[t]
-            counts[j] += 1
-        for j in range(k):
-            if counts[j] > 0:
-                centroids[j] = [new_c[j][t] / counts[j] for t in range(3)]
-
-    return [
-        (round(centroids[j][0] * 255), round(centroids[j][1] * 255), round(centroids[j][2] * 255))
-        for j in range(k)
-    ]
-
-
-def nearest_palette_index(r, g, b, palette):
-    """RGB に最も近いパレットのインデックスを返す。"""
-    best_i = 0
-    best_d = (r - palette[0][0]) ** 2 + (g - palette[0][1]) ** 2 + (b - palette[0][2]) ** 2
-    for i in range(1, len(palette)):
-        pr, pg, pb = palette[i]
-        d = (r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2
-        if d < best_d:
-            best_d, best_i = d, i
-    return best_i
-
-
-def floyd_steinberg_dither(img_rgb, palette, width, height):
-    """画像（RGB 2D、0..255）をパレットで Floyd–Steinberg ディザ。"""
-    f = [[[float(img_rgb[y][x][c]) for c in range(3)] for x in range(width)] for y in range(height)]
-    out = [[(0, 0, 0) for _ in range(width)] for _ in range(height)]
-
-    for y in range(height):
-        for x in range(width):
-            r = max(0, min(255, round(f[y][x][0])))
-            g = max(0, min(255, round(f[y][x][1])))
-            b = max(0, min(255, round(f[y][x][2])))
-            idx = nearest_palette_index(r, g, b, palette)
-            pr, pg, pb = palette[idx]
-            out[y][x] = (pr, pg, pb)
-            er = f[y][x][0] - pr
-            eg = f[y][x][1] - pg
-            eb = f[y][x][2] - pb
-            if x + 1 < width:
-                f[y][x + 1][0] += er * 7 / 16
-                f[y][x + 1][1] += eg * 7 / 16
-                f[y][x + 1][2] += eb * 7 / 16
-            if y + 1 < height:
-                f[y + 1][x][0] += er * 5 / 16
-                f[y + 1][x][1] += eg * 5 / 16
-                f[y + 1][x][2] += eb * 5 / 16
-                if x - 1 >= 0:
-                    f[y + 1][x - 1][0] += er * 3 / 16
-                    f[y + 1][x - 1][1] += eg * 3 / 16
-                    f[y + 1][x - 1][2] += eb * 3 / 16
-                if x + 1 < width:
-                    f[y + 1][x + 1][0] += er * 1 / 16
-                    f[y + 1][x + 1][1] += eg * 1 / 16
-                    f[y + 1][x + 1][2] += eb * 1 / 16
-    return out
-
-
-def reduce_color_from_arrays(rgb_2d, alpha_2d, width, height, num_colors, use_dither, max_pixels_for_palette=500000, kmeans_iterations=30):
-    """
-    rgb_2d[y][x] = (r,g,b) 0..255, alpha_2d[y][x] = 0..255
-    返り値: out_rgb_2d (同じ形式), およびパレット（参考用）
-    """
-    pixels_flat = [
-        (rgb_2d[y][x][0], rgb_2d[y][x][1], rgb_2d[y][x][2])
-        for y in range(height) for x in range(width)
-    ]
-    rgb_for_palette = []
-    for y in range(height):
-        for x in range(width):
-            if alpha_2d[y][x] >= 128:
-                rgb_for_palette.append(rgb_2d[y][x])
-    if not rgb_for_palette:
-        rgb_for_palette = list(pixels_flat)
-    if len(rgb_for_palette) > max_pixels_for_palette:
-        step = len(rgb_for_palette) // max_pixels_for_palette
-        rgb_for_palette = rgb_for_palette[::step]
-
-    palette = kmeans_palette(rgb_for_palette, num_colors, max_iter=kmeans_iterations)
-
-    if use_dither:
-        out_rgb_2d = floyd_steinberg_dither(rgb_2d, palette, width, height)
-    else:
-        out_rgb_2d = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                r, g, b = rgb_2d[y][x]
-                idx = nearest_palette_index(r, g, b, palette)
-                row.append(palette[idx])
-            out_rgb_2d.append(row)
-
-    return out_rgb_2d, palette
+from reduce_color_core import reduce_color_from_arrays
 
 
 # ---------- Blender オペレーター ----------
@@ -214,30 +92,19 @@ class REDUCE_COLOR_OT_png(bpy.types.Operator, ImportHelper):
 
         w = img.size[0]
         h = img.size[1]
-        # Blender の pixels は float 0..1、RGBA の flat
-        raw = list(img.pixels)
-        rgb_2d = []
-        alpha_2d = []
-        for y in range(h):
-            row_rgb = []
-            row_a = []
-            for x in range(w):
-                i = (y * w + x) * 4
-                r = int(round(raw[i] * 255))
-                g = int(round(raw[i + 1] * 255))
-                b = int(round(raw[i + 2] * 255))
-                a = int(round(raw[i + 3] * 255))
-                row_rgb.append((r, g, b))
-                row_a.append(a)
-            rgb_2d.append(row_rgb)
-            alpha_2d.append(row_a)
+        # Blender の pixels は float 0..1、RGBA の flat。foreach_get で一括で読み、0..255 の uint8 に変換
+        buf = np.empty(w * h * 4, dtype=np.float32)
+        img.pixels.foreach_get(buf)
+        px = np.clip(np.round(buf.reshape(h, w, 4) * 255.0), 0, 255).astype(np.uint8)
+        rgb = px[:, :, :3]
+        alpha = px[:, :, 3]
 
         # 読み込み済み画像は参照を外してから削除可能（今回だけ使う場合）
         img_name = img.name
         bpy.data.images.remove(img)
 
-        out_rgb_2d, _ = reduce_color_from_arrays(
-            rgb_2d, alpha_2d, w, h,
+        out_rgb, _ = reduce_color_from_arrays(
+            rgb, alpha, w, h,
             num_colors=self.num_colors,
             use_dither=self.use_dither,
             kmeans_iterations=self.kmeans_iterations,
@@ -250,13 +117,10 @@ class REDUCE_COLOR_OT_png(bpy.types.Operator, ImportHelper):
             height=h,
             alpha=True,
         )
-        out_flat = []
-        for y in range(h):
-            for x in range(w):
-                r, g, b = out_rgb_2d[y][x]
-                a = alpha_2d[y][x] / 255.0
-                out_flat.extend([r / 255.0, g / 255.0, b / 255.0, a])
-        out_img.pixels.foreach_set(out_flat)
+        out = np.empty((h, w, 4), dtype=np.float32)
+        out[:, :, :3] = out_rgb / np.float32(255.0)
+        out[:, :, 3] = alpha / np.float32(255.0)
+        out_img.pixels.foreach_set(out.ravel())
         out_img.filepath_raw = output_path
         out_img.file_format = "PNG"
         out_img.save()
@@ -31,33 +31,31 @@ HIDE_ORIGINAL_AFTER_BAKE = True
 
 
 def get_remesh_modifier(obj):
-    for m in obj.modifiers:
-        if m.type == "REMESH":
-            return m
-    return None
+    return next((m for m in obj.modifiers if m.type == "REMESH"), None)
+
+
+def _set_if(obj, name, value):
+    """プロパティがあれば設定する（Blender のバージョンによって無いプロパティは無視。hasattr の往復を避ける）。"""
+    try:
+        setattr(obj, name, value)
+    except AttributeError:
+        pass
 
 
 def ensure_remesh_modifier(obj, mode="BLOCKS", octree_depth=8, scale=0.9,
                            voxel_size=0.1, remove_disconnected=True, threshold=1.0):
     """リメッシュモディファイアを追加または取得し、パラメータを設定する。"""
-    mod = get_remesh_modifier(obj)
-    if mod is None:
-        bpy.ops.object.modifier_add(type="REMESH")
-        mod = get_remesh_modifier(obj)
+    mod = get_remesh_modifier(obj) or obj.modifiers.new("Remesh", "REMESH")
     if mod is None:
         return None
     mod.mode = mode
     if mode == "VOXEL":
         mod.voxel_size = voxel_size
     else:
-        if hasattr(mod, "octree_depth"):
-            mod.octree_depth = octree_depth
-        if hasattr(mod, "scale"):
-            mod.scale = scale
-    if hasattr(mod, "use_remove_disconnected"):
-        mod.use_remove_disconnected = remove_disconnected
-    if hasattr(mod, "threshold"):
-        mod.threshold = threshold
+        _set_if(mod, "octree_depth", octree_depth)
+        _set_if(mod, "scale", scale)
+    _set_if(mod, "use_remove_disconnected", remove_disconnected)
+    _set_if(mod, "threshold", threshold)
     return mod
 
 
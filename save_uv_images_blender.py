@@ -3,42 +3,114 @@
 Blender で UV/マテリアルに使われている画像（JPG・PNG 等）をフォルダにまとめて保存するスクリプト。
 
 - パックされた画像（.blend 内に取り込んだ画像）もファイルとして書き出せます。
+- Blender の Python に Pillow が入っていれば、8bit の PNG/JPEG は複数スレッドで並行に書き出します。
 - スクリプトを実行後、F3 で「UV画像を保存」と検索して実行するか、
   画像エディタの「画像」メニューから「UV画像をフォルダに保存」を実行してください。
 """
 
 import os
 import re
+import shutil
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import bpy
+import numpy as np
 from bpy_extras.io_utils import ExportHelper
 
+try:
+    # 任意: Pillow があれば 8bit の PNG/JPEG はスレッドで並行にエンコードして書き出す（Blender 標準には含まれない）
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+# Pillow で書き出せる拡張子 → Pillow の形式名
+_PIL_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+# Pillow で書き出すチャンネル数（1: L, 2: LA, 3: RGB, 4: RGBA）。それ以外は Blender の保存処理に任せる
+_PIL_CHANNELS = (1, 2, 3, 4)
+# Pillow で PNG を書くときの zlib 圧縮レベル（Blender 標準の圧縮 15% と同程度。Pillow 既定の 6 は数倍遅い）
+PNG_COMPRESS_LEVEL = 1
+
 
 def images_used_by_selected_objects():
     """選択オブジェクトのマテリアルで参照されている画像のセットを返す。"""
     used = set()
+    # 複数オブジェクト・複数スロットで共有されているマテリアルのノードは 1 回だけ走査する
+    seen_materials = set()
     for obj in bpy.context.selected_objects:
         if obj.type != "MESH" or not obj.data:
             continue
-        for slot in getattr(obj.material_slots, "values", []) or []:
+        for slot in obj.material_slots:
             mat = slot.material
-            if not mat or not getattr(mat, "node_tree", None):
+            if not mat or mat in seen_materials:
                 continue
-            for node in mat.node_tree.nodes:
-                if node.type != "TEX_IMAGE" or not getattr(node, "image", None):
-                    continue
-                used.add(node.image)
+            seen_materials.add(mat)
+            if mat.node_tree is None:
+                continue
+            used.update(
+                node.image for node in mat.node_tree.nodes
+                if node.type == "TEX_IMAGE" and node.image is not None
+            )
     return used
 
 
+# 画像名 → ファイル名の変換に使うパターン（画像ごとに re.sub でパターンを引かないよう先にコンパイル）
+_IMAGE_EXT_RE = re.compile(r"\.(png|jpg|jpeg|tga|bmp|exr|hdr)$", re.I)
+_BAD_FILENAME_CHARS_RE = re.compile(r"[<>:\"/\\|?*\x00-\x1f]")
+
+
 def sanitize_filename(name):
     """Blender の画像名をファイル名に使えるようにする。"""
     # 拡張子っぽい suffix は一旦除く（後で format に合わせて付ける）
-    base = re.sub(r"\.(png|jpg|jpeg|tga|bmp|exr|hdr)$", "", name, flags=re.I)
-    base = re.sub(r"[<>:\"/\\|?*\x00-\x1f]", "_", base)
+    base = _IMAGE_EXT_RE.sub("", name)
+    base = _BAD_FILENAME_CHARS_RE.sub("_", base)
     return base.strip() or "image"
 
 
+def _unchanged_source_file(img):
+    """
+    画像がディスク上のファイルそのまま（パックされておらず Blender で未編集）なら、その絶対パスを返す。
+    そうでなければ None（エンコードし直して保存する必要がある）。
+    """
+    if img.packed_file or img.is_dirty or img.source != "FILE" or not img.filepath_raw:
+        return None
+    src = bpy.path.abspath(img.filepath_raw, library=img.library)
+    return src if os.path.isfile(src) else None
+
+
+def _pixels_as_uint8(img):
+    """
+    8bit 画像のピクセルを上の行から順の uint8 配列にして (配列, Pillow のモード) で返す。
+    bpy のデータに触るのでメインスレッドで呼ぶ。
+    """
+    w, h = img.size
+    channels = img.channels
+    buf = np.empty(w * h * channels, dtype=np.float32)
+    img.pixels.foreach_get(buf)
+    # Blender のピクセルは下の行から並ぶので上下を反転
+    arr = np.clip(np.round(buf.reshape(h, w, channels) * 255.0), 0, 255).astype(np.uint8)[::-1]
+    if channels == 2:
+        return np.ascontiguousarray(arr[:, :, :2]), "LA"
+    if img.depth == 8 or channels == 1:
+        return np.ascontiguousarray(arr[:, :, 0]), "L"
+    if img.depth == 24 or channels == 3:
+        return np.ascontiguousarray(arr[:, :, :3]), "RGB"
+    return np.ascontiguousarray(arr[:, :, :4]), "RGBA"
+
+
+def _save_with_pil(arr, mode, filepath, pil_format):
+    """_pixels_as_uint8 の配列を Pillow で書き出す（bpy に触らないのでワーカースレッドで実行できる）。"""
+    if pil_format == "JPEG" and mode == "RGBA":
+        arr, mode = arr[:, :, :3], "RGB"
+    elif pil_format == "JPEG" and mode == "LA":
+        arr, mode = np.ascontiguousarray(arr[:, :, 0]), "L"
+    out = PILImage.fromarray(arr, mode)
+    if pil_format == "JPEG":
+        out.save(filepath, pil_format, quality=90)
+    else:
+        out.save(filepath, pil_format, compress_level=PNG_COMPRESS_LEVEL)
+
+
 class SAVE_UV_IMAGES_OT_to_folder(bpy.types.Operator, ExportHelper):
     """UV/マテリアルで使っている画像を指定フォルダに保存する"""
     bl_idname = "save_uv_images.to_folder"
@@ -74,59 +146,113 @@ class SAVE_UV_IMAGES_OT_to_folder(bpy.types.Operator, ExportHelper):
     def execute(self, context):
         # ダイアログで選んだファイルの親フォルダを出力先にする
         out_dir = bpy.path.abspath(os.path.dirname(self.filepath))
-        if not os.path.isdir(out_dir):
-            try:
-                os.makedirs(out_dir, exist_ok=True)
-            except Exception as e:
-                self.report({"ERROR"}, f"出力フォルダを作成できません: {e}")
-                return {"CANCELLED"}
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+        except Exception as e:
+            self.report({"ERROR"}, f"出力フォルダを作成できません: {e}")
+            return {"CANCELLED"}
 
         if self.only_selected:
-            to_save = list(images_used_by_selected_objects())
+            to_save = [img for img in images_used_by_selected_objects() if img.size[0] and img.size[1]]
             if not to_save:
                 self.report({"WARNING"}, "選択オブジェクトで参照されている画像がありません")
                 return {"CANCELLED"}
         else:
-            # パック画像（.blend 内）も含めてすべての画像を保存対象にする
-            to_save = [img for img in bpy.data.images if getattr(img, "type", None) == "IMAGE"]
+            # パック画像（.blend 内）も含めてすべての画像を保存対象にする（サイズ 0 の画像はここで除く）
+            to_save = [img for img in bpy.data.images if img.type == "IMAGE" and img.size[0] and img.size[1]]
 
-        # 同じベース名が出ないよう、連番を付けることがある
-        base_counts = {}
-        saved = []
+        # 拡張子は形式ごとに一度だけ決めた関数で引く（ループ内で self.save_format を見ない）
+        save_format = self.save_format
+        if save_format == "AUTO":
+            def ext_for(img):
+                if img.filepath_raw:
+                    return os.path.splitext(img.filepath_raw)[1].lower() or ".png"
+                return ".png"
+        else:
+            fixed_ext = ".png" if save_format == "PNG" else ".jpg"
+
+            def ext_for(img):
+                return fixed_ext
+        file_format = save_format if save_format in ("PNG", "JPEG") else None
+
+        # 保存先パスを先にまとめて決める。同じベース名が出ないよう、連番を付けることがある
+        # （連番を付けた名前が別の画像の名前と重なることもあるので、決まったファイル名も控えて避ける。
+        #   Windows/macOS では大文字小文字を区別しないので小文字で比べる）
+        base_counts = defaultdict(int)
+        used_names = set()
+        targets = []
         for img in to_save:
-            if img.size[0] == 0 or img.size[1] == 0:
-                continue
             base = sanitize_filename(img.name)
-            if self.save_format == "AUTO":
-                if img.filepath_raw:
-                    ext = os.path.splitext(img.filepath_raw)[1].lower() or ".png"
-                else:
-                    ext = ".png"
-            elif self.save_format == "PNG":
-                ext = ".png"
-            else:
-                ext = ".jpg"
-            if base not in base_counts:
-                base_counts[base] = 0
-            base_counts[base] += 1
-            stem = base if base_counts[base] == 1 else f"{base}_{base_counts[base]}"
-            filepath = os.path.join(out_dir, stem + ext)
-
-            orig_path = img.filepath_raw
-            orig_format = getattr(img, "file_format", "PNG")
-            try:
-                img.filepath_raw = filepath
-                if self.save_format == "PNG":
-                    img.file_format = "PNG"
-                elif self.save_format == "JPEG":
-                    img.file_format = "JPEG"
-                img.save()
-                saved.append(filepath)
-            except Exception as e:
-                self.report({"ERROR"}, f"保存失敗 {img.name}: {e}")
-            finally:
-                img.filepath_raw = orig_path
-                img.file_format = orig_format
+            ext = ext_for(img)
+            key = base.lower()
+            base_counts[key] += 1
+            stem = base if base_counts[key] == 1 else f"{base}_{base_counts[key]}"
+            while (stem + ext).lower() in used_names:
+                base_counts[key] += 1
+                stem = f"{base}_{base_counts[key]}"
+            used_names.add((stem + ext).lower())
+            targets.append((img, os.path.join(out_dir, stem + ext)))
+
+        saved = []
+        # Pillow があれば 8bit の PNG/JPEG は、ピクセルの読み出しだけメインスレッドで行い、エンコードと書き込みをスレッドに回す
+        # （読み出した配列を溜め込みすぎないよう、未完了の書き出しはワーカー数の 2 倍までにする）
+        workers = os.cpu_count() or 1
+        pending = {}
+
+        def collect(done):
+            for fut in done:
+                name, path = pending.pop(fut)
+                try:
+                    fut.result()
+                    saved.append(path)
+                except Exception as e:
+                    self.report({"ERROR"}, f"保存失敗 {name}: {e}")
+
+        # スレッドは最初の submit で起動するので、Pillow がなくても作っておいて害はない。
+        # with を抜けるときに（ループ途中の例外でも）書き出し中のスレッドを待って後始末する
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for img, filepath in targets:
+                # 未編集のファイル画像で拡張子も同じなら、エンコードせずファイルをコピーする（保存先が元ファイル自身なら何もしない）
+                src = _unchanged_source_file(img)
+                if src is not None and os.path.splitext(src)[1].lower() == os.path.splitext(filepath)[1]:
+                    try:
+                        if not (os.path.exists(filepath) and os.path.samefile(src, filepath)):
+                            shutil.copyfile(src, filepath)
+                        saved.append(filepath)
+                    except Exception as e:
+                        self.report({"ERROR"}, f"保存失敗 {img.name}: {e}")
+                    continue
+
+                pil_format = _PIL_FORMATS.get(os.path.splitext(filepath)[1])
+                if PILImage is not None and pil_format is not None and not img.is_float and img.channels in _PIL_CHANNELS:
+                    try:
+                        arr, mode = _pixels_as_uint8(img)
+                    except Exception as e:
+                        self.report({"ERROR"}, f"保存失敗 {img.name}: {e}")
+                        continue
+                    if len(pending) >= 2 * workers:
+                        collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                    pending[executor.submit(_save_with_pil, arr, mode, filepath, pil_format)] = (img.name, filepath)
+                    continue
+
+                # save_render はシーンのビュー変換が掛かって色が変わるので使わない。
+                # filepath_raw は再読み込みを起こさないので、これだけ差し替えて save() し、形式は変わるときだけ書き換える
+                orig_path = img.filepath_raw
+                orig_format = img.file_format
+                change_format = file_format is not None and file_format != orig_format
+                try:
+                    img.filepath_raw = filepath
+                    if change_format:
+                        img.file_format = file_format
+                    img.save()
+                    saved.append(filepath)
+                except Exception as e:
+                    self.report({"ERROR"}, f"保存失敗 {img.name}: {e}")
+                finally:
+                    img.filepath_raw = orig_path
+                    if change_format:
+                        img.file_format = orig_format
+            collect(wait(pending).done)
 
         if saved:
             self.report({"INFO"}, f"{len(saved)} 件を保存しました: {out_dir}")
@@ -5,6 +5,9 @@ PNG画像を縦2×横3の6等分に分割し、
 """
 
 import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 try:
@@ -13,14 +16,66 @@ except ImportError:
     print("Pillow が必要です: pip install Pillow")
     raise SystemExit(1)
 
+try:
+    # 任意: pyvips があれば画像全体を展開せず、上から順に読みながらタイルを書き出す
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+
+# PNG にそのまま保存できるモード（それ以外は RGBA に変換してから分割する）
+PNG_MODES = ("1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16")
+# これより画素数が多い画像は 6 枚の PNG エンコードをスレッドで並行に行う（小さい画像はスレッド起動の方が高くつく）
+PARALLEL_MIN_PIXELS = 1_000_000
+
+
+def _cell_bounds(size, count):
+    """
+    長さ size を count 個に分ける境界座標（count+1 個）を返す。
+    割り切れない余りの画素は捨てずに各セルへ 1 画素ずつ振り分ける。
+    """
+    if size < count:
+        raise ValueError(f"画像が小さすぎて {count} 分割できません（{size} px）")
+    return [i * size // count for i in range(count + 1)]
+
+
+def _split_png_6_pyvips(path, out_dir, base_name, cols, rows, compress_level):
+    """
+    pyvips で 6 分割する。タイルごとに sequential で開き直すので、
+    デコードは上から必要な行までで済み、画像全体をメモリに置かない。
+    """
+    header = pyvips.Image.new_from_file(str(path))
+    xs = _cell_bounds(header.width, cols)
+    ys = _cell_bounds(header.height, rows)
+
+    saved = []
+    for row in range(rows):
+        for col in range(cols):
+            idx = row * cols + col + 1  # 1〜6
+            out_path = out_dir / f"{base_name}_{idx}.png"
+            # sequential は上方向に戻れないため、1 枚の画像から 6 回 crop せずタイルごとに開く
+            v = pyvips.Image.new_from_file(str(path), access="sequential")
+            v.crop(xs[col], ys[row], xs[col + 1] - xs[col], ys[row + 1] - ys[row]).pngsave(
+                str(out_path), compression=compress_level
+            )
+            saved.append(out_path)
+    return saved
+
 
-def split_png_6(input_path: str, output_dir: str | None = None, prefix: str | None = None) -> list[Path]:
+def split_png_6(
+    input_path: str,
+    output_dir: str | None = None,
+    prefix: str | None = None,
+    compress_level: int = 1,
+) -> list[Path]:
     """
     PNGを縦2・横3の6等分に分割し、左上から 1〜6 の番号付きで保存する。
+    幅・高さが割り切れないときは、余りの画素を捨てずにいくつかのセルを 1 画素大きくする。
 
     - input_path: 入力PNGのパス
     - output_dir: 出力先ディレクトリ（省略時は入力ファイルと同じディレクトリ）
     - prefix: 出力ファイル名のプレフィックス（省略時は入力ファイル名の拡張子なし）
+    - compress_level: PNG の圧縮レベル 0〜9（小さいほど速く、ファイルは大きい）
 
     戻り値: 保存したファイルパスのリスト
     """
@@ -30,30 +85,41 @@ def split_png_6(input_path: str, output_dir: str | None = None, prefix: str | No
     if path.suffix.lower() not in (".png",):
         print("警告: 拡張子が .png ではありません。そのまま処理します。")
 
-    img = Image.open(path).convert("RGBA")
-    w, h = img.size
-
-    cols, rows = 3, 2
-    cell_w = w // cols
-    cell_h = h // rows
-
     out_dir = Path(output_dir).resolve() if output_dir else path.parent
     out_dir.mkdir(parents=True, exist_ok=True)
     base_name = prefix if prefix is not None else path.stem
+    cols, rows = 3, 2
 
-    saved = []
+    if pyvips is not None:
+        return _split_png_6_pyvips(path, out_dir, base_name, cols, rows, compress_level)
+
+    # 元のモード（グレースケール・パレット等）のまま分割する。RGBA への変換で展開し直さない
+    img = Image.open(path)
+    img.load()
+    if img.mode not in PNG_MODES:
+        img = img.convert("RGBA")
+    w, h = img.size
+
+    xs = _cell_bounds(w, cols)
+    ys = _cell_bounds(h, rows)
+
+    tiles = []
     for row in range(rows):
         for col in range(cols):
             idx = row * cols + col + 1  # 1〜6
-            left = col * cell_w
-            top = row * cell_h
-            box = (left, top, left + cell_w, top + cell_h)
-            crop = img.crop(box)
-            out_path = out_dir / f"{base_name}_{idx}.png"
-            crop.save(out_path, "PNG")
-            saved.append(out_path)
+            box = (xs[col], ys[row], xs[col + 1], ys[row + 1])
+            tiles.append((img.crop(box), out_dir / f"{base_name}_{idx}.png"))
 
-    return saved
+    def save_tile(tile):
+        crop, out_path = tile
+        crop.save(out_path, "PNG", compress_level=compress_level)
+        return out_path
+
+    # Pillow はエンコード中に GIL を離すので、大きい画像は 6 枚をスレッドで同時に書き出す
+    if w * h > PARALLEL_MIN_PIXELS:
+        with ThreadPoolExecutor(max_workers=min(len(tiles), os.cpu_count() or 1)) as ex:
+            return list(ex.map(save_tile, tiles))
+    return [save_tile(t) for t in tiles]
 
 
 def main():
@@ -63,7 +129,8 @@ def main():
     parser.add_argument(
         "input",
         type=str,
-        help="入力PNGファイルのパス",
+        nargs="+",
+        help="入力PNGファイルのパス（複数指定可）",
     )
     parser.add_argument(
         "-o", "--output-dir",
@@ -77,12 +144,46 @@ def main():
         default=None,
         help="出力ファイル名のプレフィックス（省略時は入力ファイル名の拡張子なし）",
     )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        default=1,
+        choices=range(10),
+        metavar="N",
+        help="PNG の圧縮レベル 0〜9（デフォルト: 1。大きいほどファイルは小さいが遅い）",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="複数ファイルを同時に処理するプロセス数（デフォルト: 1）",
+    )
     args = parser.parse_args()
-
-    saved = split_png_6(args.input, args.output_dir, args.prefix)
-    print(f"6分割して保存しました:")
-    for p in saved:
-        print(f"  {p}")
+    if args.jobs < 1:
+        parser.error("--jobs は 1 以上を指定してください")
+    # 出力先とファイル名（拡張子なし）が同じ入力は、互いのタイルを上書きしてしまうので先に止める
+    seen = {}
+    for input_path in args.input:
+        src = Path(input_path).resolve()
+        out_dir = Path(args.output_dir).resolve() if args.output_dir else src.parent
+        key = os.path.normcase(str(out_dir / (args.prefix if args.prefix is not None else src.stem)))
+        if key in seen:
+            parser.error(f"{seen[key]} と {input_path} の出力ファイル名が重なります（{key}_1〜6.png）")
+        seen[key] = input_path
+
+    split = partial(split_png_6, output_dir=args.output_dir, prefix=args.prefix, compress_level=args.compress_level)
+    # 複数ファイルはプロセスに分けて並行に処理する（起動と Pillow の読み込みは 1 回で済む）
+    if args.jobs > 1 and len(args.input) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(args.input))) as ex:
+            results = list(ex.map(split, args.input))
+    else:
+        results = [split(p) for p in args.input]
+
+    for input_path, saved in zip(args.input, results):
+        print(f"6分割して保存しました: {input_path}")
+        for p in saved:
+            print(f"  {p}")
 
 
 if __name__ == "__main__":